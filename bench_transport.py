@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import time
+
+import transport
+
+
+# Transport benchmark
+# Runs a fake handset on a pseudo-terminal that answers :GR# and :GD# and measures
+# wall-clock latency and process CPU time per command for transport.RawPort and,
+# when pyserial is installed, for the serial.Serial port control.py opens by default.
+# The fake handset runs in the same process, so its CPU time is included for every path.
+#     python bench_transport.py [commands]
+
+REPLIES = {b':GR#': b'12:34:56#', b':GD#': b'+45\xdf12:34#'}
+
+
+def fake_handset(fd, stop):
+    pending = b''
+    while not stop.is_set():
+        try:
+            data = os.read(fd, 64)
+        except OSError:
+            return
+        pending += data
+        while b'#' in pending:
+            command, pending = pending.split(b'#', 1)
+            reply = REPLIES.get(command + b'#')
+            if reply:
+                os.write(fd, reply)
+
+
+def run(port, readline, count):
+    latencies = []
+    cpu = time.process_time()
+    for i in range(count):
+        command = ':GR#' if i % 2 else ':GD#'
+        t0 = time.perf_counter()
+        port.write(command)
+        readline()
+        latencies.append(time.perf_counter() - t0)
+    cpu = time.process_time() - cpu
+    latencies.sort()
+    return cpu / count, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    master, slave = os.openpty()
+    stop = threading.Event()
+    threading.Thread(target=fake_handset, args=(master, stop), daemon=True).start()
+    name = os.ttyname(slave)
+    results = []
+
+    raw = transport.RawPort(name, timeout=1)
+    results.append(('RawPort.read_frame', run(raw, raw.read_frame, count)))
+    results.append(('RawPort.readline', run(raw, raw.readline, count)))
+    raw.close()
+
+    try:
+        import serial
+    except ImportError:
+        serial = None
+    if serial is not None:
+        # pyserial wants bytes and frames on '\n'; read_until('#') keeps the comparison fair
+        port = serial.Serial(name, 9600, timeout=1)
+        write = port.write
+        port.write = lambda data: write(data.encode('latin-1'))
+        results.append(('serial.read_until', run(port, lambda: port.read_until(b'#'), count)))
+        port.close()
+
+    print('{:<20s} {:>12s} {:>12s} {:>12s}'.format('path', 'cpu/cmd us', 'p50 us', 'p99 us'))
+    for label, (cpu, p50, p99) in results:
+        print('{:<20s} {:12.1f} {:12.1f} {:12.1f}'.format(label, cpu * 1e6, p50 * 1e6, p99 * 1e6))
+    stop.set()
+
+
+if __name__ == '__main__':
+    main()
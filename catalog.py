@@ -0,0 +1,261 @@
+import csv
+import math
+
+import telemetry
+
+
+# Local deep-sky catalog
+# Stands in for the L – Object Library commands, which the Autostar and LX200GPS
+# mostly answer with static strings. Objects are loaded from catalog files
+# (OpenNGC's NGC.csv or a plain name,type,ra,dec,mag,size[,quality] CSV) and kept in a
+# k-d tree over unit vectors, so cone searches are exact across RA 0h/24h and the poles.
+
+# Object class letters as used by :Gy# / :Sy# (G P D C O)
+CLASS_BY_TYPE = {
+    'G': 'G', 'GPair': 'G', 'GTrpl': 'G', 'GGroup': 'G',
+    'PN': 'P',
+    'Neb': 'D', 'EmN': 'D', 'RfN': 'D', 'HII': 'D', 'SNR': 'D', 'Cl+N': 'D',
+    'GCl': 'C',
+    'OCl': 'O', '*Ass': 'O',
+}
+
+# :Gq# quality codes, best first
+QUALITIES = ['SU', 'EX', 'VG', 'GD', 'FR', 'PR', 'VP']
+
+
+class CatalogObject(object):
+    __slots__ = ('name', 'kind', 'ra', 'dec', 'mag', 'size', 'quality', 'aliases')
+
+    def __init__(self, name, kind, ra, dec, mag=None, size=None, quality=None, aliases=()):
+        self.name = name
+        self.kind = kind
+        self.ra = ra
+        self.dec = dec
+        self.mag = mag
+        self.size = size
+        self.quality = quality
+        self.aliases = tuple(aliases)
+
+    def __repr__(self):
+        return 'CatalogObject({!r}, {!r}, ra={:.4f}, dec={:.3f}, mag={!r}, size={!r})'.format(
+            self.name, self.kind, self.ra, self.dec, self.mag, self.size)
+    # kind is a :Gy# class letter (G P D C O) or '?', ra in hours, dec in degrees, size in arcminutes;
+    # aliases are other designations find() knows it by (M31 for NGC0224)
+
+
+class Constraints(object):
+    __slots__ = ('bright', 'faint', 'min_size', 'max_size', 'quality', 'classes')
+
+    def __init__(self, bright=None, faint=None, min_size=None, max_size=None, quality=None, classes='GPDCO'):
+        self.bright = bright
+        self.faint = faint
+        self.min_size = min_size
+        self.max_size = max_size
+        self.quality = quality
+        self.classes = classes
+
+    def accepts(self, obj):
+        if obj.kind not in self.classes:
+            return False
+        if obj.mag is not None:
+            if self.bright is not None and obj.mag < self.bright:
+                return False
+            if self.faint is not None and obj.mag > self.faint:
+                return False
+        if obj.size is not None:
+            if self.min_size is not None and obj.size < self.min_size:
+                return False
+            if self.max_size is not None and obj.size > self.max_size:
+                return False
+        if self.quality is not None and obj.quality is not None:
+            if QUALITIES.index(obj.quality) > QUALITIES.index(self.quality):
+                return False
+        return True
+
+    @classmethod
+    def from_scope(cls, scope):
+        # Reads the handset's FIND/BROWSE settings. :Gy# upper case letters are the wanted classes.
+        def number(text):
+            return float(text.strip().rstrip('#').rstrip("'’"))
+        sizes = sorted([number(scope.get_size_small_lim()), number(scope.get_size_large_lim())])
+        return cls(bright=number(scope.get_mag_bright_lim()),
+                   faint=number(scope.get_mag_faint_lim()),
+                   min_size=sizes[0],
+                   max_size=sizes[1],
+                   quality=scope.get_quality_min().strip().rstrip('#') or None,
+                   classes=''.join(c for c in scope.get_dso_string() if c.isupper()))
+    # The manual's descriptions of :Gl# and :Gs# contradict each other, so the two size limits
+    # are simply taken as the lower and upper bound.
+
+
+def _key(name):
+    return name.replace(' ', '').upper()
+
+def _unit(ra, dec):
+    a = math.radians(ra * 15.0)
+    d = math.radians(dec)
+    return (math.cos(d) * math.cos(a), math.cos(d) * math.sin(a), math.sin(d))
+
+
+class Catalog(object):
+    def __init__(self, objects=()):
+        self.objects = list(objects)
+        self._build()
+
+    def __len__(self):
+        return len(self.objects)
+
+    def add(self, objects):
+        self.objects.extend(objects)
+        self._build()
+
+    def _build(self):
+        # Flat k-d tree: self.tree[i] = (object index, split axis, left node, right node)
+        self.points = [_unit(o.ra, o.dec) for o in self.objects]
+        self.tree = []
+        self.root = self._split(list(range(len(self.objects))), 0)
+        # find() index: names and aliases, one entry per object rather than one point per name
+        self.names = {}
+        for obj in self.objects:
+            for name in (obj.name,) + obj.aliases:
+                self.names.setdefault(_key(name), obj)
+
+    def _split(self, indices, depth):
+        if not indices:
+            return -1
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        mid = len(indices) // 2
+        node = len(self.tree)
+        self.tree.append(None)
+        left = self._split(indices[:mid], depth + 1)
+        right = self._split(indices[mid + 1:], depth + 1)
+        self.tree[node] = (indices[mid], axis, left, right)
+        return node
+
+    def cone(self, ra, dec, radius, constraints=None):
+        # Objects within `radius` degrees of (ra hours, dec degrees), nearest first.
+        centre = _unit(ra, dec)
+        chord = 2.0 * math.sin(math.radians(min(radius, 180.0)) / 2.0)
+        limit = chord * chord
+        hits = []
+        stack = [self.root]
+        points = self.points
+        tree = self.tree
+        while stack:
+            node = stack.pop()
+            if node < 0:
+                continue
+            index, axis, left, right = tree[node]
+            p = points[index]
+            dx = p[0] - centre[0]
+            dy = p[1] - centre[1]
+            dz = p[2] - centre[2]
+            dist = dx * dx + dy * dy + dz * dz
+            if dist <= limit:
+                obj = self.objects[index]
+                if constraints is None or constraints.accepts(obj):
+                    hits.append((dist, index))
+            delta = centre[axis] - p[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            stack.append(near)
+            if delta * delta <= limit:
+                stack.append(far)
+        hits.sort()
+        return [self.objects[i] for _, i in hits]
+
+    def around_scope(self, scope, constraints=None, radius=None):
+        # Cone search around the current telescope position. The radius defaults to half of the
+        # :GF# find field diameter (arcminutes), like the handset's IDENTIFY.
+        ra = telemetry.parse_ra(scope.get_tel_ra())
+        dec = telemetry.parse_dms(scope.get_telescope_dec())
+        if radius is None:
+            radius = float(scope.get_field_diameter().strip().rstrip('#')) / 120.0
+        return self.cone(ra, dec, radius, constraints)
+
+    def find(self, name):
+        return self.names.get(_key(name))
+
+
+def _sexagesimal(text):
+    parts = text.replace(':', ' ').split()
+    sign = -1.0 if parts[0].startswith('-') else 1.0
+    value = abs(float(parts[0]))
+    for n, part in enumerate(parts[1:]):
+        value += float(part) / 60.0 ** (n + 1)
+    return sign * value
+
+def _optional(text):
+    return float(text) if text not in (None, '') else None
+
+def load_openngc(path):
+    # OpenNGC NGC.csv / addendum.csv (semicolon separated, sexagesimal RA/Dec).
+    # Messier designations become aliases of their NGC/IC entry so find('M31') works.
+    objects = []
+    with open(path) as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            if not row.get('RA') or not row.get('Dec'):
+                continue
+            kind = CLASS_BY_TYPE.get(row['Type'], '?')
+            mag = _optional(row.get('V-Mag')) or _optional(row.get('B-Mag'))
+            aliases = ['M{:d}'.format(int(row['M']))] if row.get('M') else []
+            objects.append(CatalogObject(row['Name'], kind, _sexagesimal(row['RA']), _sexagesimal(row['Dec']),
+                                         mag, _optional(row.get('MajAx')), aliases=aliases))
+    return objects
+
+def _class(kind):
+    kind = kind.strip()
+    if kind in CLASS_BY_TYPE:
+        return CLASS_BY_TYPE[kind]
+    return kind.upper() if len(kind) == 1 and kind.upper() in 'GPDCO' else '?'
+
+def _quality(text, name):
+    quality = (text or '').strip().upper() or None
+    assert quality is None or quality in QUALITIES, \
+        '{}: quality {!r} is not one of {}'.format(name, text, ' '.join(QUALITIES))
+    return quality
+
+def load_csv(path):
+    # name,type,ra,dec,mag,size[,quality] with a header row; ra in hours, dec in degrees,
+    # type either a class letter (G P D C O) or an OpenNGC type, quality a :Gq# code.
+    objects = []
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            objects.append(CatalogObject(row['name'], _class(row['type']),
+                                         float(row['ra']), float(row['dec']),
+                                         _optional(row.get('mag')), _optional(row.get('size')),
+                                         _quality(row.get('quality'), row['name'])))
+    return objects
+
+def load(*paths):
+    objects = []
+    for path in paths:
+        with open(path) as f:
+            header = f.readline()
+        objects.extend(load_openngc(path) if ';' in header else load_csv(path))
+    return Catalog(objects)
+
+
+def set_target_coords(scope, ra, dec):
+    # Upload RA (hours) / Dec (degrees) as the current target via :Sr / :Sd
+    ra = ra % 24.0
+    hh = int(ra)
+    mm = int((ra - hh) * 60.0)
+    ss = int(round(((ra - hh) * 60.0 - mm) * 60.0))
+    if ss == 60:
+        ss, mm = 0, mm + 1
+    if mm == 60:
+        mm, hh = 0, (hh + 1) % 24
+    absdec = abs(dec)
+    dd = int(absdec)
+    dm = int((absdec - dd) * 60.0)
+    ds = int(round(((absdec - dd) * 60.0 - dm) * 60.0))
+    if ds == 60:
+        ds, dm = 0, dm + 1
+    if dm == 60:
+        dm, dd = 0, dd + 1
+    return (scope.set_target_ra(hh, mm, ss),
+            scope.set_target_dec(math.copysign(dd, dec), dm, ds))
+
+def set_target(scope, obj):
+    return set_target_coords(scope, obj.ra, obj.dec)
@@ -0,0 +1,150 @@
+import math
+import threading
+import time
+
+import telemetry
+
+
+# Handset clock synchronisation
+# The handset only reports whole seconds, so its offset from the host is found by
+# probing :GL# until the displayed second ticks over; the tick lies between the
+# midpoints of the last two probes, which bounds the offset to about one round trip.
+# Setting the time is then timed so the :SL# command lands on the handset just as
+# the host crosses the second it carries.
+
+DAY = 86400.0
+
+
+def _local_seconds(t):
+    lt = time.localtime(t)
+    return lt.tm_hour * 3600 + lt.tm_min * 60 + lt.tm_sec + (t % 1.0)
+
+def _wrap(seconds):
+    # fold a time-of-day difference into [-12h, 12h)
+    return (seconds + DAY / 2) % DAY - DAY / 2
+
+
+def probe(scope):
+    # One timed :GL# round trip -> (host time at send, round trip seconds, handset seconds of day)
+    with scope.lock:
+        t0 = time.time()
+        reply = scope.get_lt24()
+        t1 = time.time()
+    return t0, t1 - t0, telemetry.parse_hms(reply)
+
+def measure_rtt(scope, probes=5):
+    rtts = sorted(probe(scope)[1] for _ in range(probes))
+    return rtts[0], rtts[len(rtts) // 2]
+    # (fastest, median) round trip in seconds
+
+def measure_offset(scope, timeout=1.5):
+    # Handset clock minus host local clock in seconds, resolved to the round trip time.
+    # Returns (offset, uncertainty).
+    t0, rtt, last = probe(scope)
+    last_mid = t0 + rtt / 2
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        t0, rtt, reading = probe(scope)
+        mid = t0 + rtt / 2
+        if reading != last:
+            # the handset ticked from `last` to `reading` somewhere in (last_mid, mid]
+            tick = (last_mid + mid) / 2
+            return _wrap(reading - _local_seconds(tick)), (mid - last_mid) / 2
+        last, last_mid = reading, mid
+    # never saw a tick (probes too slow); fall back to whole-second resolution
+    return _wrap(last + 0.5 - _local_seconds(last_mid)), 0.5
+
+
+def sync(scope, rtt=None, force_date=False):
+    # Set handset local time (and date/UTC offset when they differ) from the host clock.
+    if rtt is None:
+        rtt = measure_rtt(scope)[0]
+    results = {}
+    with scope.lock:
+        handset_date = None if force_date else scope.get_date().strip().rstrip('#')
+        handset_offset = None if force_date else float(scope.get_utc_offset().strip().rstrip('#'))
+        while True:
+            # aim for the command to arrive one way-trip before the next whole second
+            now = time.time()
+            target = math.floor(now) + 1.0
+            if target - now < rtt / 2 + 0.05:
+                target += 1.0
+            # date, offset and time all describe `target`, so a sync just before midnight
+            # writes the new day along with 00:00:00
+            st = time.localtime(target)
+            date = time.strftime('%m/%d/%y', st)
+            utc_offset = -st.tm_gmtoff / 3600.0
+            if date != handset_date:
+                results['date'] = scope.set_date(st.tm_mon, st.tm_mday, st.tm_year)
+                handset_date = date
+            elif handset_offset is None or abs(handset_offset - utc_offset) > 0.01:
+                results['utc_offset'] = scope.set_utc_offset(utc_offset)
+                handset_offset = utc_offset
+            else:
+                break
+            # writing took time: aim again
+        time.sleep(max(0.0, target - rtt / 2 - time.time()))
+        results['time'] = scope.set_local_time(st.tm_hour, st.tm_min, st.tm_sec)
+    return results
+    # Date and UTC offset are only written when they differ, since :SC# makes the
+    # handset recompute its planetary data.
+
+
+def expected_lst(t, east_longitude):
+    # Local sidereal time in seconds of day for unix time t (IAU 1982 GMST, plenty for a check)
+    d = t / DAY + 2440587.5 - 2451545.0
+    gmst = 18.697374558 + 24.06570982441908 * d
+    return ((gmst + east_longitude / 15.0) % 24.0) * 3600.0
+
+def verify_lst(scope, tolerance=2.0):
+    # Compare :GS# with the LST computed from the host clock and the handset's site longitude.
+    # Returns the error in seconds, or raises AssertionError beyond `tolerance`.
+    with scope.lock:
+        east_longitude = -telemetry.parse_dms(scope.get_site_long())
+        t0 = time.time()
+        lst = telemetry.parse_hms(scope.get_lst())
+        t1 = time.time()
+    error = _wrap(lst + 0.5 - expected_lst((t0 + t1) / 2, east_longitude))
+    assert abs(error) <= tolerance, 'handset LST off by {:.1f} s'.format(error)
+    return error
+    # :Gg# reports East longitudes as negative, hence the sign flip
+
+
+class ClockSync(threading.Thread):
+    # Background drift check: every `interval` seconds measure the handset offset and
+    # resync when it exceeds `tolerance`. A check costs a few dozen short :GL# probes,
+    # and the port lock is released between probes.
+
+    def __init__(self, scope, interval=900.0, tolerance=0.25):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scope = scope
+        self.interval = interval
+        self.tolerance = tolerance
+        self.stopped = threading.Event()
+        self.offset = None
+        self.uncertainty = None
+        self.syncs = 0
+        self.last_error = None
+
+    def check(self):
+        self.offset, self.uncertainty = measure_offset(self.scope)
+        if abs(self.offset) > self.tolerance:
+            rtt = measure_rtt(self.scope)[0]
+            sync(self.scope, rtt)
+            self.syncs += 1
+            verify_lst(self.scope)
+            self.offset, self.uncertainty = measure_offset(self.scope)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.check()
+                self.last_error = None
+            except (AssertionError, ValueError, IndexError, IOError, OSError) as e:
+                # a port outage (connection.ConnectionLost is an IOError) only skips this check
+                self.last_error = e
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,357 @@
+import collections
+import threading
+import time
+
+import framing
+from control import split_command
+
+
+# Managed connection: lazy open, health checking, reconnect with state restore
+# ManagedPort wraps the whole port stack (same wrapper pattern as framing.FramedPort)
+# and builds it with opener(baudrate) on first use rather than at construction:
+#     scope = Autostar(connection.ManagedPort(lambda rate: framing.FramedPort(open_serial(dev, rate))))
+# A read or write that raises IOError/OSError (a USB-serial adapter that went away), or a
+# missing reply followed by an unanswered ACK probe (a handset that is still powering up),
+# makes it close the stack and reopen it with exponential backoff. A handset that was
+# power-cycled quickly enough to answer the probe is caught by its replies instead: an ACK
+# mount mode or :GR# precision that differs from the remembered one means it came back in
+# its power-on state, and the stack is reopened all the same. Once the handset answers the
+# ACK probe again the last known state the wrapper has seen go past is restored:
+#   - baud rate (:SBn#), re-negotiated from 9600 when the handset came back at its default
+#   - mount mode (:AA#/:AL#/:AP#), site (:Wn#) and tracking rate/mode (:ST/:T/:TQ/:TL/:TM)
+#   - high precision pointing (:P#) and display precision (:U#, checked against :GR#)
+# Commands caught by the outage are written again when they are safe to repeat (queries);
+# anything else whose reply was lost raises ConnectionLost instead of guessing.
+# Heartbeat sends alignment_query() when the line has been idle, so an outage is noticed
+# and repaired before the next real command needs the port. Like the other background
+# services it takes scope.lock, so callers sharing the scope must hold it too.
+
+# :SBn# digits; the manual's 56.7K is the standard 57600
+BAUD_RATES = {1: 57600, 2: 38400, 3: 28800, 4: 19200, 5: 14400, 6: 9600, 7: 4800, 8: 2400, 9: 1200}
+DEFAULT_BAUDRATE = 9600
+
+# what readline() does with a command after a reconnect: read as usual, write it again, or fail
+SEND, RESEND, FAIL = range(3)
+
+
+class ConnectionLost(IOError):
+    pass
+
+
+def _replies(opcode):
+    return framing.SHAPES.get(opcode, (framing.NONE, None))[0] != framing.NONE
+
+def _precision(reply):
+    # :GR# is HH:MM:SS# in high precision and HH:MM.T# in low
+    body = reply.strip().rstrip('#')
+    return 'high' if body.count(':') == 2 else 'low' if '.' in body else None
+
+
+class ManagedPort(object):
+    # readline() returns whole replies (tracing.TracedPort times around it)
+    framed = True
+
+    def __init__(self, opener, baudrate=DEFAULT_BAUDRATE, backoff=0.25, max_backoff=4.0,
+                 give_up=60.0, probe_timeout=0.5, rates=None):
+        # rates: baud rates the opener can open (None: all of BAUD_RATES), e.g. transport.BAUD_RATES
+        self.opener = opener
+        self.rates = rates
+        self._check_rate(baudrate)
+        self.baudrate = baudrate
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.give_up = give_up
+        self.probe_timeout = probe_timeout
+        self.port = None
+        self.pending = collections.deque()
+        self.last_activity = 0.0
+        # last known handset state, replayed after a reconnect
+        self.mount = None
+        self.site = None
+        self.tracking = collections.OrderedDict()
+        self.pointing = None
+        self.precision = None
+        self.counters = collections.Counter()
+        self.last_outage = None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.connect(), name)
+
+    # connection management
+    def _open(self, baudrate):
+        port = self.opener(baudrate)
+        timeout = getattr(port, 'timeout', None)
+        try:
+            port.timeout = self.probe_timeout
+        except AttributeError:
+            timeout = None
+        try:
+            port.reset_input_buffer()
+            port.write('\x06')
+            reply = port.readline()
+        except (IOError, OSError):
+            self._close(port)
+            raise
+        if timeout is not None:
+            port.timeout = timeout
+        if reply not in ('A', 'L', 'P'):
+            self._close(port)
+            return None, None
+        return port, reply
+
+    def _close(self, port):
+        try:
+            port.close()
+        except (IOError, OSError, AttributeError):
+            pass
+
+    def _handshake(self):
+        # Open at the last known rate; a handset that was power-cycled is back at 9600
+        port, mode = self._open(self.baudrate)
+        if port is None and self.baudrate != DEFAULT_BAUDRATE:
+            port, mode = self._open(DEFAULT_BAUDRATE)
+            if port is not None:
+                self._exchange(port, ':SB{:d}#'.format(self._baud_digit(self.baudrate)))
+                self._close(port)
+                time.sleep(0.1)
+                port, mode = self._open(self.baudrate)
+        if port is None:
+            raise IOError('no reply to the ACK probe')
+        return port, mode
+
+    def connect(self):
+        if self.port is not None:
+            return self.port
+        start = time.time()
+        delay = self.backoff
+        while True:
+            try:
+                port, mode = self._handshake()
+                break
+            except (IOError, OSError) as error:
+                self.counters['connect_failures'] += 1
+                if time.time() - start + delay > self.give_up:
+                    raise ConnectionLost('handset not reachable after {:.0f}s: {}'.format(time.time() - start, error))
+            time.sleep(delay)
+            delay = min(self.max_backoff, delay * 2)
+        self.port = port
+        self.counters['connects'] += 1
+        self.restore(mode)
+        self.last_activity = time.time()
+        return port
+
+    def reconnect(self):
+        # Drop the current stack and connect again; commands waiting for replies are
+        # marked to be re-sent (queries) or failed (anything else).
+        start = time.time()
+        self.counters['reconnects'] += 1
+        if self.port is not None:
+            self._close(self.port)
+            self.port = None
+        self.pending = collections.deque(
+            (command, opcode, RESEND if framing._idempotent(opcode) else FAIL)
+            for command, opcode, _ in self.pending)
+        try:
+            return self.connect()
+        finally:
+            self.last_outage = time.time() - start
+
+    def close(self):
+        if self.port is not None:
+            self._close(self.port)
+            self.port = None
+        self.pending.clear()
+
+    # state tracking and restore
+    def _check_rate(self, baudrate):
+        if baudrate not in BAUD_RATES.values() or (self.rates is not None and baudrate not in self.rates):
+            raise ValueError('unsupported baud rate {}'.format(baudrate))
+        return baudrate
+
+    def _baud_digit(self, baudrate):
+        for digit, rate in BAUD_RATES.items():
+            if rate == baudrate:
+                return digit
+        raise ValueError('unsupported baud rate {}'.format(baudrate))
+
+    def _exchange(self, port, command):
+        # every write is paired with a readline, as in Autostar, so a FramedPort stays in step
+        port.write(command)
+        return port.readline()
+
+    def _observe_command(self, command, opcode, args):
+        if opcode in ('AA', 'AL', 'AP'):
+            self.mount = opcode[1]
+        elif opcode == 'W':
+            self.site = int(args)
+        elif opcode in ('TQ', 'TL', 'TM') or (opcode == 'T' and args):
+            self.tracking['mode'] = command
+        elif opcode == 'ST':
+            self.tracking['rate'] = command
+        elif opcode == 'U' and self.precision:
+            self.precision = 'low' if self.precision == 'high' else 'high'
+
+    def _observe_reply(self, command, opcode, reply):
+        # returns the reply, asked again when it came from a handset that had been reset
+        if opcode == 'ACK' and reply in ('A', 'L', 'P'):
+            if self.mount and reply != self.mount:
+                self._reset()
+            self.mount = self.mount or reply
+        elif opcode == 'GR':
+            precision = _precision(reply)
+            if self.precision and precision and precision != self.precision:
+                self._reset()
+                reply = self._exchange(self.port, command)
+            else:
+                self.precision = precision or self.precision
+        elif opcode == 'P' and 'PRECISION' in reply.upper():
+            self.pointing = reply.upper().strip().rstrip('#').split()[0]
+        elif opcode == 'SB' and reply.startswith('1'):
+            # the handset switches after acknowledging at the old rate
+            self.baudrate = BAUD_RATES[int(split_command(command)[1])]  # checked in write()
+            self._close(self.port)
+            self.port = None
+            self.connect()
+        return reply
+
+    def _reset(self):
+        # the handset forgot what it was told (power-cycled between two commands): every
+        # change made since is gone, so start over as after any other outage
+        self.counters['resets'] += 1
+        self.reconnect()
+
+    def restore(self, mode):
+        port = self.port
+        if self.mount and mode != self.mount:
+            self._exchange(port, ':A{}#'.format(self.mount))
+        if self.site is not None:
+            self._exchange(port, ':W{:d}#'.format(self.site))
+        for command in self.tracking.values():
+            self._exchange(port, command)
+        if self.pointing:
+            # :P# answers with the setting it leaves, so at most two toggles
+            for _ in range(2):
+                if self._exchange(port, ':P#').upper().startswith(self.pointing):
+                    break
+        if self.precision:
+            if _precision(self._exchange(port, ':GR#')) not in (None, self.precision):
+                self._exchange(port, ':U#')
+        self.counters['restores'] += 1
+
+    # port interface
+    def write(self, data):
+        commands = ['\x06'] if data == '\x06' else [c + '#' for c in data.split('#') if c]
+        for command in commands:
+            opcode, args = split_command(command)
+            if opcode == 'SB':
+                # refused before the handset switches to a rate the port stack cannot reopen at
+                self._check_rate(BAUD_RATES.get(int(args)) if args.isdigit() else None)
+        port = self.connect()
+        try:
+            result = port.write(data)
+        except (IOError, OSError):
+            # nothing was answered yet, so the whole write is safe to repeat
+            port = self.reconnect()
+            result = port.write(data)
+        for command in commands:
+            opcode, args = split_command(command)
+            self._observe_command(command, opcode, args)
+            self.pending.append((command, opcode, SEND))
+        self.last_activity = time.time()
+        return result
+
+    def readline(self):
+        if not self.pending:
+            return self.connect().readline()
+        command, opcode, state = self.pending.popleft()
+        if state == FAIL:
+            if _replies(opcode):
+                raise ConnectionLost('reply to {!r} lost in a reconnect'.format(command))
+            return ''
+        try:
+            port = self.connect()
+            if state == RESEND:
+                self.counters['resent'] += 1
+                port.write(command)
+            reply = port.readline()
+        except (IOError, OSError):
+            self.pending.appendleft((command, opcode, FAIL))
+            self.reconnect()
+            command, opcode, state = self.pending.popleft()
+            if framing._idempotent(opcode):
+                self.counters['resent'] += 1
+                self.port.write(command)
+                reply = self.port.readline()
+            elif _replies(opcode):
+                raise ConnectionLost('reply to {!r} lost in a reconnect'.format(command))
+            else:
+                reply = ''
+        self.last_activity = time.time()
+        if not reply and _replies(opcode) and opcode not in framing.SLOW:
+            self.counters['missed'] += 1
+            if not self.alive():
+                # the handset stopped answering altogether: start over
+                self.reconnect()
+            if framing._idempotent(opcode):
+                # ask again either way; a late reply has been dealt with by the probe
+                self.counters['resent'] += 1
+                reply = self._exchange(self.port, command)
+        return self._observe_reply(command, opcode, reply)
+
+    def alive(self):
+        # ACK probe on the open stack; a late reply is told apart from a handset that is gone
+        if self.port is None:
+            return False
+        try:
+            reply = self._exchange(self.port, '\x06')
+        except (IOError, OSError):
+            return False
+        if reply not in ('A', 'L', 'P'):
+            return False
+        self._observe_reply('\x06', 'ACK', reply)
+        return True
+
+    def reset_input_buffer(self):
+        self.pending.clear()
+        if self.port is not None:
+            return self.port.reset_input_buffer()
+
+
+class Heartbeat(threading.Thread):
+    def __init__(self, scope, interval=5.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scope = scope
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.beats = 0
+        self.failures = 0
+
+    def beat(self):
+        port = self.scope.port
+        with self.scope.lock:
+            if not port.counters['connects'] or time.time() - port.last_activity < self.interval:
+                # not connected yet (lazy) or the line is busy enough to prove itself
+                return True
+            self.beats += 1
+            try:
+                # a missing reply is followed up (and repaired) by the port itself
+                self.scope.alignment_query()
+                return True
+            except (AssertionError, IOError, OSError):
+                self.failures += 1
+            try:
+                if not port.alive():
+                    port.reconnect()
+            except (IOError, OSError):
+                pass
+            return False
+
+    def run(self):
+        while not self.stopped.wait(self.interval / 2.0):
+            self.beat()
+
+    def stop(self):
+        self.stopped.set()
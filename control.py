@@ -1,26 +1,100 @@
+import math
 import os
 import sys
-import serial
+import threading
+import time
+
+import nmea
+
+def split_command(command):
+    body = command.strip().lstrip(':').rstrip('#')
+    if command == '\x06':
+        return 'ACK', ''
+    if body.startswith('GV') or body.startswith('$') or body.startswith('gps'):
+        n = 3
+    elif len(body) >= 2 and (body[1].isalpha() or body[1] in '+-?' or body[:2] in ('G0', 'G1', 'G2')):
+        n = 2
+    else:
+        n = 1
+    return body[:n], body[n:]
+# ':Sr12:34:56#' -> ('Sr', '12:34:56'), ':GVP#' -> ('GVP', ''), ':T+#' -> ('T+', ''), ':B5#' -> ('B', '5')
+# ':G0#' -> ('G0', ''): the alignment-star queries are the only opcodes ending in a digit
+
+class SerialText(object):
+    # pyserial takes bytes and frames readline() on '\n'; the handset talks '#'-terminated text
+    def __init__(self, port):
+        self.port = port
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    @property
+    def timeout(self):
+        return self.port.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.port.timeout = value
+
+    def write(self, data):
+        return self.port.write(data if isinstance(data, bytes) else data.encode('latin-1'))
+
+    def readline(self):
+        return self.port.read_until(b'#').decode('latin-1')
+
+def open_serial(device='/dev/ttyAMA0', baudrate=9600):
+    import serial
+    return SerialText(serial.Serial(
+        port=device,
+        baudrate = baudrate,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.EIGHTBITS,
+        timeout=1
+    ))
 
 class Autostar():
-    def __init__(self):
-        self.port = serial.Serial(
-            port='/dev/ttyAMA0',
-            baudrate = 9600,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            bytesize=serial.EIGHTBITS,
-            timeout=1
-        )
+    def __init__(self, port=None, device='/dev/ttyAMA0', baudrate=9600):
+        if port is None:
+            import connection
+            import framing
+            port = connection.ManagedPort(lambda rate: framing.FramedPort(open_serial(device, rate)), baudrate)
+        self.port = port
+        self.lock = threading.RLock()
+    # `port` is any object with write/readline/reset_input_buffer, e.g. transport.RawPort for
+    # the termios/epoll path. Without one a framed pyserial port on `device` is opened on first
+    # use and reopened (with the handset state restored) if it fails; see connection.py.
+
+    def heartbeat(self, interval=5.0):
+        import connection
+        beat = connection.Heartbeat(self, interval)
+        beat.start()
+        return beat
+    # Checks an idle line with alignment_query() and reconnects when the handset is gone.
+    # Needs the default (connection.ManagedPort) port. stop() ends it.
         
+    # Pipelined queries
+    def query_batch(self, commands, depth=8):
+        responses = []
+        with self.lock:
+            for i in range(0, len(commands), depth):
+                chunk = commands[i:i + depth]
+                self.port.write(''.join(chunk))
+                responses.extend(self.port.readline() for _ in chunk)
+        return responses
+    # Writes up to `depth` commands back to back before reading their replies in order, so a
+    # batch of G-queries costs one round trip per chunk instead of one per command.
+    # Only use for commands that always reply; a silent command would shift every later reply.
+
     # ACK - Alignment Query
     def alignment_query(self):
-        self.port.write('0x06')
+        self.port.write('\x06')
         response = self.port.readline()
         assert response in ['A', 'L', 'P']
         return response
     # ACK <0x06> Query of alignment mounting mode. Returns:
     # A If scope in AltAz Mode / L If scope in Land Mode / P If scope in Polar Mode
+    # The query is the single byte 0x06, not the text '0x06'
 
 
     # A - Alignment Commands
@@ -90,7 +164,8 @@ class Autostar():
     # <n> Values of 0..9 for Autostar and LX200GPS Return: Nothing
     
     def set_reticule_flash_cycle(self, value):
-        # self.port.write(':T+#')
+        assert value in range(16)
+        self.port.write(':BD{:d}#'.format(value))
         response = self.port.readline()
         return response
     # :BDn# Set Reticule Duty flash duty cycle to <n> (an ASCII expressed digit) [LX200 GPS Only] 
@@ -195,17 +270,62 @@ class Autostar():
 
     
     # g – GPS/Magnetometer commands
-    
+    def gps_on(self):
+        self.port.write(':g+#')
+        response = self.port.readline()
+        return response
     # :g+# LX200GPS Only - Turn on GPS Returns: Nothing
     
+    def gps_off(self):
+        self.port.write(':g-#')
+        response = self.port.readline()
+        return response
     # :g-# LX200GPS Only - Turn off GPS
     
+    def gps_sentence(self):
+        with self.lock:
+            self.port.write(':gps#')
+            response = self.port.readline()
+        return response
     # :gps# LX200GPS Only – Turns on NMEA GPS data stream.
     # Returns: The next string from the GPS in standard NEMA format followed by a ‘#’ key
     
+    def gps_stream(self, interval=0.5):
+        parser = nmea.NmeaParser()
+        last = 0.0
+        while True:
+            wait = last + interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            last = time.time()
+            response = self.gps_sentence()
+            if not response:
+                continue
+            if not response.rstrip().endswith('#'):
+                response += '#'
+            for fix in parser.feed(response):
+                yield fix
+    # Generator over decoded GGA/RMC fixes (see nmea.py), one :gps# poll per interval.
+    # Polling is driven by the consumer, so a slow reader simply polls less; the port lock
+    # is only held for a single poll, leaving the command channel free in between.
+    
+    def gps_update_time(self, cancel=None, timeout=600):
+        deadline = time.time() + timeout
+        with self.lock:
+            self.port.write(':gT#')
+            while True:
+                response = self.port.readline()
+                if response:
+                    return response
+                if (cancel is not None and cancel.is_set()) or time.time() > deadline:
+                    self.port.reset_input_buffer()
+                    return None
     # :gT# Powers up the GPS and updates the system time from the GPS stream. The process my take several minutes to complete. During GPS update, normal handbox operations are interrupted. [LX200gps only]
     # Returns: ‘0’ In the event that the user interrupts the process, or the GPS times out.
     # Returns: ‘1’ After successful updates
+    # Waits on the readline timeout until the handset answers, `cancel` (a threading.Event) is set or
+    # `timeout` seconds pass; None is returned when the wait is abandoned. Cancelling only stops
+    # waiting on our side, the handset finishes the update on its own.
 
 
     # G – Get Telescope Information
@@ -621,10 +741,18 @@ class Autostar():
     # 0 Slew is Possible
     # 1<string># Object Below Horizon w/string message 
     # 2<string># Object Below Higher w/string message
+    
+    def manual_control(self, window=0.05):
+        import jog
+        channel = jog.ManualControl(self, window)
+        channel.start()
+        return channel
+    # Joystick/web-pad channel: press/release/set_rate/halt from any thread, redundant
+    # Me/Mn/Ms/Mw, Q* and R* traffic is coalesced (see jog.py). close() halts and stops it.
 
 
     # P - High Precision Toggle
-    def toggle_precision(self):
+    def toggle_high_precision(self):
         self.port.write(':P#')
         response = self.port.readline()
         return response
@@ -777,7 +905,7 @@ class Autostar():
     # 0 Object within slew range 1 Object out of slew range
     
     def set_bright_limit(self, mag):
-        self.port.write(':MS#')
+        self.port.write(':Sb{:+05.1f}#'.format(mag))
         response = self.port.readline()
         return response
     # :SbsMM.M#
@@ -787,7 +915,7 @@ class Autostar():
     
     def set_baud_rate(self, value):
         assert value in range(1,10)
-        self.port.write(':MS#')
+        self.port.write(':SB{:1d}#'.format(value))
         response = self.port.readline()
         return response
     # :SBn# Set Baud Rate n, where n is an ASCII digit (1..9) with the following interpertation
@@ -798,21 +926,26 @@ class Autostar():
     # 1
     
     def set_date(self, mm, dd, yy):
-        self.port.write(':MS#')
+        self.port.write(':SC{:02d}/{:02d}/{:02d}#'.format(mm, dd, yy % 100))
         response = self.port.readline()
+        if response.startswith('1'):
+            response += self.port.readline()
         return response
     # :SCMM/DD/YY#
     # Change Handbox Date to MM/DD/YY Returns: <D><string>
     # D = ‘0’ if the date is invalid. The string is the null string.
     # D = ‘1’ for valid dates and the string is “Updating Planetary Data# #” Note: For LX200GPS this is the UTC data!
+    # The trailing blank line of a valid date is read here so it does not show up as the next reply
     
     def set_target_dec(self, dd, mm, ss):
-        self.port.write(':MS#')
+        sign = '-' if math.copysign(1, dd) < 0 else '+'
+        self.port.write(':Sd{}{:02d}*{:02d}:{:02d}#'.format(sign, int(abs(dd)), mm, ss))
         response = self.port.readline()
         return response
     # :SdsDD*MM#
     # Set target object declination to sDD*MM or sDD*MM:SS depending on the current precision setting Returns:
     # 1 - Dec Accepted 0 – Dec invalid
+    # dd carries the sign; pass -0.0 for declinations between 0 and -1 degree
     
     def set_selen_lat(self, dd, mm):
         self.port.write(':MS#')
@@ -831,7 +964,7 @@ class Autostar():
     # 0 – If the coordinates are invalid for any reason.
     
     def set_faint_mag_limit(self, mag):
-        self.port.write(':MS#')
+        self.port.write(':Sf{:+05.1f}#'.format(mag))
         response = self.port.readline()
         return response
     # :SfsMM.M#
@@ -839,7 +972,7 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_id_field_diam(self, mm):
-        self.port.write(':MS#')
+        self.port.write(':SF{:03d}#'.format(mm))
         response = self.port.readline()
         return response
     # :SFNNN#
@@ -849,7 +982,7 @@ class Autostar():
     # 1 - Valid
     
     def set_site_long(self, ddd, mm):
-        self.port.write(':MS#')
+        self.port.write(':Sg{:03d}*{:02d}#'.format(ddd, mm))
         response = self.port.readline()
         return response
     # :SgDDD*MM#
@@ -859,7 +992,7 @@ class Autostar():
     # 1 - Valid 
     
     def set_utc_offset(self, offset):
-        self.port.write(':MS#')
+        self.port.write(':SG{:+05.1f}#'.format(offset))
         response = self.port.readline()
         return response
     # :SGsHH.H#
@@ -867,7 +1000,7 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_elev_limit_min(self, dd):
-        self.port.write(':MS#')
+        self.port.write(':Sh{:02d}#'.format(dd))
         response = self.port.readline()
         return response
     # :ShDD#
@@ -875,7 +1008,7 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_size_limit_min(self, mm):
-        self.port.write(':MS#')
+        self.port.write(':Sl{:03d}#'.format(mm))
         response = self.port.readline()
         return response
     # :SlNNN#
@@ -883,7 +1016,7 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_local_time(self, hh, mm, ss):
-        self.port.write(':MS#')
+        self.port.write(':SL{:02d}:{:02d}:{:02d}#'.format(hh, mm, ss))
         response = self.port.readline()
         return response
     # :SLHH:MM:SS#
@@ -895,13 +1028,13 @@ class Autostar():
     def set_site_name(self, id, name):
         assert id in range(1,5)
         if id == 1:
-            self.port.write(':SM{:15s}#')
+            self.port.write(':SM{:.15s}#'.format(name))
         if id == 2:
-            self.port.write(':SN{:15s}#')
+            self.port.write(':SN{:.15s}#'.format(name))
         if id == 3:
-            self.port.write(':SO{:15s}#')
+            self.port.write(':SO{:.15s}#'.format(name))
         if id == 4:
-            self.port.write(':SP{:15s}#')
+            self.port.write(':SP{:.15s}#'.format(name))
         response = self.port.readline()
         return response
     # :SM<string>#
@@ -912,7 +1045,7 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_elev_limit_max(self, dd):
-        self.port.write(':MS#')
+        self.port.write(':So{:02d}*#'.format(dd))
         response = self.port.readline()
         return response
     # :SoDD*#
@@ -920,14 +1053,14 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def cycle_quality_limit(self):
-        self.port.write(':MS#')
+        self.port.write(':Sq#')
         response = self.port.readline()
         return response
     # :Sq#
     # Step the quality of limit used in FIND/BROWSE through its cycle of VP ... SU. Current setting can be queried with :Gq# Returns: Nothing
     
     def set_target_ra(self, hh, mm, ss):
-        self.port.write(':MS#')
+        self.port.write(':Sr{:02d}:{:02d}:{:02d}#'.format(hh, mm, ss))
         response = self.port.readline()
         return response
     # :SrHH:MM.T# :SrHH:MM:SS#
@@ -935,7 +1068,7 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_size_limit_max(self, mm):
-        self.port.write(':MS#')
+        self.port.write(':Ss{:03d}#'.format(mm))
         response = self.port.readline()
         return response
     # :SsNNN#
@@ -943,7 +1076,7 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_lst(self, hh, mm, ss):
-        self.port.write(':MS#')
+        self.port.write(':SS{:02d}:{:02d}:{:02d}#'.format(hh, mm, ss))
         response = self.port.readline()
         return response
     # :SSHH:MM:SS#
@@ -951,16 +1084,18 @@ class Autostar():
     # 0 – Invalid 1 - Valid
     
     def set_site_lat(self, dd, mm):
-        self.port.write(':MS#')
+        sign = '-' if math.copysign(1, dd) < 0 else '+'
+        self.port.write(':St{}{:02d}*{:02d}#'.format(sign, int(abs(dd)), mm))
         response = self.port.readline()
         return response
     # :StsDD*MM#
     # Sets the current site latitdue to sDD*MM# Returns:
     # 0 – Invalid 1 - Valid
+    # dd carries the sign; pass -0.0 for latitudes between 0 and -1 degree
     
     def set_tracking_rate(self, rate):
         assert rate > 0.0
-        self.port.write(':MS#')
+        self.port.write(':ST{:04.1f}#'.format(rate))
         response = self.port.readline()
         return response
     # :STTT.T#
@@ -968,22 +1103,23 @@ class Autostar():
     # Returns:
     # 0 – Invalid 1 - Valid
     
-    def set_slew_rate_max(self, rate):
+    def set_max_slew_rate(self, rate):
         assert rate in range(2,9)
-        self.port.write(':MS#')
+        self.port.write(':Sw{:1d}#'.format(rate))
         response = self.port.readline()
         return response
     # :SwN#
     # Set maximum slew rate to N degrees per second. N is the range (2..8) Returns: 0 – Invalid 1 - Valid
     
     def set_obj_sel_string(self, value):
-        assert value in ['G', 'P', 'D', 'C', 'O']
-        self.port.write(':MS#')
+        assert len(value) == 5 and value.upper() == 'GPDCO'
+        self.port.write(':Sy{}#'.format(value))
         response = self.port.readline()
         return response
     # :SyGPDCO#
     # Sets the object selection string used by the FIND/BROWSE command. Returns:
     # 0 – Invalid 1 - Valid
+    # Same letters as :Gy#, upper case to include a class and lower case to skip it, e.g. 'GPdcO'
     
     def set_target_az(self, ddd, mm):
         self.port.write(':MS#')
@@ -1074,9 +1210,186 @@ class Autostar():
         return response
     # :?-# Retreive previos line of the handbox help text file. Returns: <string>#
     # The <string> contains the next string of general handbox help file
+    
+    def iter_help(self, cache_dir=os.path.join('~', '.cache', 'honeypi'), ahead=4, max_lines=5000):
+        cache_dir = os.path.expanduser(cache_dir)
+        with self.lock:
+            product = self.get_product_name().strip().rstrip('#').strip()
+            firmware = self.get_firmware_num().strip().rstrip('#').strip()
+        name = 'help-{}-{}.txt'.format(product, firmware).replace(' ', '_').replace(os.sep, '_')
+        path = os.path.join(cache_dir, name)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    yield line.rstrip('\n')
+            return
+        with self.lock:
+            first = self.help_start()
+        if not first.endswith('#'):
+            raise IOError('no reply to :??#')
+        first = first.strip().rstrip('#')
+        lines = [first]
+        complete = False
+        yield first
+        try:
+            while len(lines) < max_lines and not complete:
+                with self.lock:
+                    for _ in range(ahead):
+                        self.port.write(':?+#')
+                    replies = [self.port.readline().strip() for _ in range(ahead)]
+                for reply in replies:
+                    if not reply.endswith('#'):
+                        raise IOError('help text timed out after {} lines'.format(len(lines)))
+                    line = reply.rstrip('#')
+                    if not line or line == first:
+                        complete = True
+                        break
+                    lines.append(line)
+                    yield line
+        finally:
+            with self.lock:
+                self.help_start()
+        if not complete:
+            return
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(path + '.tmp', path)
+    # Streams the whole help file in chunks of `ahead` pipelined :?+# requests. The port lock is
+    # held only while a chunk is on the wire, so a slow consumer does not stall other threads.
+    # The end of the file is an empty '#' reply or the point where the text wraps back to the
+    # first line; a reply that times out raises IOError instead. Only a complete download is
+    # cached, per product name and firmware number, so later calls read the file from disk
+    # without touching the port. Closing the generator early also skips the cache write.
+
+# Command line
+#   python control.py get ra dec alt az         one-shot, queries pipelined
+#   python control.py slew_east                 any Autostar method, arguments after the name
+#   python control.py run session.txt           batch file, one command per line ('#' comments)
+#   python control.py                           interactive shell with tab completion
+# Imports beyond the standard library happen only once a port is opened, so one-shot
+# invocations start quickly.
+
+QUERIES = {
+    'ra': ':GR#', 'dec': ':GD#', 'alt': ':GA#', 'az': ':GZ#', 'lst': ':GS#',
+    'time': ':GL#', 'date': ':GC#', 'utc_offset': ':GG#', 'lat': ':Gt#', 'long': ':Gg#',
+    'target_ra': ':Gr#', 'target_dec': ':Gd#', 'tracking_rate': ':GT#', 'temp': ':fT#',
+    'product': ':GVP#', 'firmware': ':GVN#', 'firmware_date': ':GVD#', 'site1': ':GM#',
+    'site2': ':GN#', 'site3': ':GO#', 'site4': ':GP#', 'quality': ':Gq#', 'classes': ':Gy#',
+    'bright_limit': ':Gb#', 'faint_limit': ':Gf#', 'field_diameter': ':GF#',
+}
+
+def _argument(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+def _commands():
+    return sorted(name for name in dir(Autostar) if not name.startswith('_'))
+
+def _open(options):
+    import connection
+    import framing
+    if options.raw:
+        import transport
+        opener = lambda rate: framing.FramedPort(transport.RawPort(options.device, rate))
+        rates = transport.BAUD_RATES
+    else:
+        opener = lambda rate: framing.FramedPort(open_serial(options.device, rate))
+        rates = None
+    return Autostar(connection.ManagedPort(opener, options.baudrate, give_up=10.0, rates=rates))
+
+def execute(scope, words, out=sys.stdout):
+    # One command line: 'get <names...>' or '<method> [args...]'
+    if not words:
+        return
+    if words[0] == 'get':
+        names = words[1:] or ['ra', 'dec']
+        unknown = [name for name in names if name not in QUERIES]
+        assert not unknown, 'unknown query: {} (one of {})'.format(' '.join(unknown), ' '.join(sorted(QUERIES)))
+        for name, reply in zip(names, scope.query_batch([QUERIES[name] for name in names])):
+            out.write('{} {}\n'.format(name, reply.strip().rstrip('#')))
+        return
+    assert words[0] in _commands(), 'unknown command: {}'.format(words[0])
+    result = getattr(scope, words[0])(*[_argument(w) for w in words[1:]])
+    if result is not None and not hasattr(result, '__next__'):
+        result = result.strip().rstrip('#') if hasattr(result, 'strip') else result
+        if result != '':
+            out.write('{}\n'.format(result))
+
+def run_batch(scope, lines, out=sys.stdout):
+    # Consecutive 'get' lines are merged into one pipelined query batch.
+    gets = []
+    for line in lines:
+        words = line.split('#', 1)[0].split()
+        if words and words[0] == 'get':
+            gets.extend(words[1:])
+            continue
+        if gets:
+            execute(scope, ['get'] + gets, out)
+            gets = []
+        execute(scope, words, out)
+    if gets:
+        execute(scope, ['get'] + gets, out)
+
+def shell(scope):
+    import cmd
+
+    class Shell(cmd.Cmd):
+        prompt = 'honeypi> '
+        intro = 'Autostar shell: get <{}> or any Autostar method; quit to leave'.format('|'.join(sorted(QUERIES)))
+
+        def default(self, line):
+            if line in ('quit', 'exit', 'EOF'):
+                return True
+            try:
+                execute(scope, line.split())
+            except (AssertionError, TypeError, ValueError, IndexError, IOError, OSError) as e:
+                # IOError includes connection.ConnectionLost: the session outlives a handset outage
+                print('error: {}'.format(e))
+
+        def emptyline(self):
+            pass
+
+        def completenames(self, text, *ignored):
+            return [name for name in ['get', 'quit'] + _commands() if name.startswith(text)]
+
+        def completedefault(self, text, line, begidx, endidx):
+            if line.split()[0] == 'get':
+                return [name for name in sorted(QUERIES) if name.startswith(text)]
+            return []
+
+    Shell().cmdloop()
 
-def main():
-    pass
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='honeypi', description='Meade Autostar/LX200 serial control')
+    parser.add_argument('--device', default='/dev/ttyAMA0')
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--raw', action='store_true', help='use the termios/epoll transport instead of pyserial')
+    parser.add_argument('command', nargs='*', help="'get <names>', a method name with arguments, or 'run <file>'")
+    options = parser.parse_args(argv)
+    try:
+        scope = _open(options)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        if not options.command:
+            shell(scope)
+        elif options.command[0] == 'run':
+            for path in options.command[1:]:
+                with (sys.stdin if path == '-' else open(path)) as f:
+                    run_batch(scope, f)
+        else:
+            execute(scope, options.command)
+    except AssertionError as e:
+        parser.exit(2, 'honeypi: {}\n'.format(e))
+    except IOError as e:
+        parser.exit(1, 'honeypi: {}\n'.format(e))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,219 @@
+import collections
+import re
+import time
+
+from control import split_command
+
+
+# Reply framing and desync recovery
+# FramedPort wraps the Autostar port (same wrapper pattern as tracing.TracedPort) and
+# remembers which opcodes are waiting for a reply. Each readline() reads exactly the
+# reply its opcode produces — nothing for commands that do not answer, one character
+# for the 0/1 setters, up to '#' for strings — and checks it against the expected
+# shape. A reply that does not fit means the stream is out of step (a late reply, a
+# truncated one, or an unexpected string such as :MS#'s 1<string>#), so the port is
+# drained, realigned with the ACK (0x06) probe, and queries are re-sent once.
+#     scope = Autostar(framing.FramedPort(control.open_serial()))
+
+NONE, CHAR, STRING, FLAG_STRING = range(4)
+
+# what readline() does for a pending command: read its reply, send it again first, give up,
+# or keep reading for a SLOW reply the caller is still polling for
+SEND, RESEND, SKIP, WAIT = range(4)
+
+_DMS = r"[+-]?\d{2}[*\xdf]\d{2}(['’:]\d{2})?#"
+_HMS = r'\d{2}:\d{2}:\d{2}#'
+_ANY = r'[^#]*#'
+
+SHAPES = {
+    'ACK': (CHAR, r'[ALP]'),
+    'Aa': (CHAR, r'[01]'), 'MA': (CHAR, r'[01]'), 'h?': (CHAR, r'[012]'), 'gT': (CHAR, r'[01]'),
+    'T': (CHAR, r'1'), 'SB': (CHAR, r'1'),
+    'CM': (STRING, _ANY), 'CL': (STRING, _ANY), 'D': (STRING, _ANY), 'P': (STRING, _ANY),
+    'fT': (STRING, r'[+-]?\d+(\.\d+)?#'), 'gps': (STRING, _ANY),
+    '??': (STRING, _ANY), '?+': (STRING, _ANY), '?-': (STRING, _ANY),
+    'G0': (STRING, _ANY), 'G1': (STRING, _ANY), 'G2': (STRING, _ANY),
+    'GA': (STRING, _DMS), 'GD': (STRING, _DMS), 'Gd': (STRING, _DMS),
+    'GZ': (STRING, r"\d{3}[*\xdf]\d{2}(['’:]\d{2})?#"),
+    'GR': (STRING, r'\d{2}:\d{2}[.:]\d{1,2}#'), 'Gr': (STRING, r'\d{2}:\d{2}[.:]\d{1,2}#'),
+    'Ga': (STRING, _HMS), 'GL': (STRING, _HMS), 'GS': (STRING, _HMS), 'GVT': (STRING, _HMS),
+    'GC': (STRING, r'\d{2}/\d{2}/\d{2}#'), 'Gc': (STRING, r'(12|24)#'),
+    'Gb': (STRING, r'[+-]?\d{1,2}\.\d#'), 'Gf': (STRING, r'[+-]?\d{1,2}\.\d#'),
+    'GF': (STRING, r'\d+#'), 'GG': (STRING, r'[+-]?\d{1,2}(\.\d)?#'),
+    'Gg': (STRING, r'[+-]?\d{1,3}[*\xdf]\d{2}#'), 'Gt': (STRING, r'[+-]?\d{2}[*\xdf]\d{2}#'),
+    'Gh': (STRING, r'[+-]?\d{1,2}[*\xdf]?#'), 'Go': (STRING, r'[+-]?\d{1,2}[*\xdf]?#'),
+    'Gl': (STRING, r"\d+['’]?#"), 'Gs': (STRING, r"\d+['’]?#"),
+    'GM': (STRING, _ANY), 'GN': (STRING, _ANY), 'GO': (STRING, _ANY), 'GP': (STRING, _ANY),
+    'Gq': (STRING, r'(SU|EX|VG|GD|FR|PR|VP)#'), 'GT': (STRING, r'\d{1,3}\.\d#'),
+    'GVD': (STRING, _ANY), 'GVN': (STRING, _ANY), 'GVP': (STRING, _ANY),
+    'Gy': (STRING, r'[GgPpDdCcOo]{5}#'),
+    # 0, or 1/2 followed by a message; a valid :SC# date is followed by two strings
+    'MS': (FLAG_STRING, r'(0|[12][^#]*#)'), 'SC': (FLAG_STRING, r'(0|1[^#]*#[^#]*#)'),
+}
+for _opcode in ('Sa', 'Sb', 'Sd', 'SE', 'Se', 'Sf', 'SF', 'Sg', 'SG', 'Sh', 'Sl', 'SL', 'SM', 'SN',
+                'SO', 'SP', 'So', 'Sr', 'Ss', 'SS', 'St', 'ST', 'Sw', 'Sy', 'Sz'):
+    SHAPES[_opcode] = (CHAR, r'[01]')
+# anything else (movement, focus, rates, toggles, ...) answers nothing
+SHAPES = dict((k, (kind, re.compile(pattern + r'\Z'))) for k, (kind, pattern) in SHAPES.items())
+
+# replies that may take minutes; a timeout just means "not yet"
+SLOW = set(['Aa', 'gT'])
+
+# safe to send twice
+def _idempotent(opcode):
+    return opcode == 'ACK' or (opcode.startswith('G') and opcode not in ('G0', 'G1', 'G2'))
+
+
+class FramedPort(object):
+    # readline() returns whole replies (tracing.TracedPort times around it)
+    framed = True
+
+    def __init__(self, port, probe_timeout=0.2, quiet=0.02, attempts=3):
+        self.port = port
+        self.probe_timeout = probe_timeout
+        self.quiet = quiet
+        self.attempts = attempts
+        self.pending = collections.deque()
+        self.dirty = False
+        self.counters = collections.Counter()
+        self.last_recovery = None
+        # perf_counter() when the first data of the last reply arrived (None: no reply)
+        self.first_byte = None
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    # so connection.ManagedPort can shorten the timeout of the port underneath for its probe
+    @property
+    def timeout(self):
+        return self.port.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.port.timeout = value
+
+    def reset_input_buffer(self):
+        self.pending.clear()
+        self.dirty = False
+        return self.port.reset_input_buffer()
+
+    def write(self, data):
+        if self.pending and self.pending[0][2] == WAIT:
+            # the caller stopped waiting for a SLOW reply: it is a timeout like any other
+            self.pending.popleft()
+            self.counters['timeouts'] += 1
+            self.dirty = True
+        if self.dirty:
+            self.resync()
+        commands = ['\x06'] if data == '\x06' else [c + '#' for c in data.split('#') if c]
+        for command in commands:
+            self.pending.append((command, split_command(command)[0], SEND))
+        return self.port.write(data)
+
+    # raw reads on the wrapped port
+    def _text(self, data):
+        if data and self.first_byte is None:
+            self.first_byte = time.perf_counter()
+        return data.decode('latin-1') if isinstance(data, bytes) else data
+
+    def _read_char(self):
+        return self._text(self.port.read(1))
+
+    def _read_string(self):
+        if hasattr(self.port, 'read_frame'):
+            return self._text(self.port.read_frame().tobytes())
+        if hasattr(self.port, 'read_until'):
+            return self._text(self.port.read_until(b'#'))
+        text = ''
+        while not text.endswith('#'):
+            ch = self._read_char()
+            if not ch:
+                break
+            text += ch
+        return text
+
+    def _read_reply(self, opcode, kind):
+        if kind == CHAR:
+            return self._read_char()
+        if kind == STRING:
+            return self._read_string()
+        flag = self._read_char()
+        if flag in ('', '0'):
+            return flag
+        reply = flag + self._read_string()
+        if opcode == 'SC':
+            reply += self._read_string()
+        return reply
+
+    def readline(self):
+        if not self.pending:
+            return ''
+        command, opcode, state = self.pending.popleft()
+        self.first_byte = None
+        kind, shape = SHAPES.get(opcode, (NONE, None))
+        if kind == NONE or state == SKIP:
+            return ''
+        if state == RESEND:
+            self.port.write(command)
+        reply = self._read_reply(opcode, kind)
+        if not reply:
+            if opcode in SLOW:
+                # stays at the head only while readline() is called again (gps_update_time's loop)
+                self.pending.appendleft((command, opcode, WAIT))
+            else:
+                # a late reply would land in front of the next command's answer
+                self.counters['timeouts'] += 1
+                self.dirty = True
+            return reply
+        if shape.match(reply):
+            return reply
+        self.counters['desyncs'] += 1
+        self.resync()
+        if _idempotent(opcode):
+            self.counters['retries'] += 1
+            self.port.write(command)
+            reply = self._read_reply(opcode, kind)
+            if reply and shape.match(reply):
+                return reply
+            self.counters['failed'] += 1
+            self.dirty = True
+        return ''
+    # After a desync the remaining pipelined commands are re-sent one by one when their
+    # replies are read (queries only; anything else reads as '' rather than risk a repeat).
+
+    def drain(self):
+        # Throw away everything already received and whatever arrives until the line is quiet.
+        self.port.reset_input_buffer()
+        timeout = self.port.timeout
+        self.port.timeout = self.quiet
+        try:
+            while self.port.read(64):
+                self.counters['drained_reads'] += 1
+        finally:
+            self.port.timeout = timeout
+
+    def probe(self):
+        timeout = self.port.timeout
+        self.port.timeout = self.probe_timeout
+        try:
+            self.port.write('\x06')
+            return self._read_char() in ('A', 'L', 'P')
+        finally:
+            self.port.timeout = timeout
+
+    def resync(self):
+        # Drain, then realign with ACK probes. Returns True once the handset answers in step.
+        start = time.time()
+        self.counters['resyncs'] += 1
+        self.pending = collections.deque(
+            (command, opcode, RESEND if _idempotent(opcode) else SKIP) for command, opcode, _ in self.pending)
+        for _ in range(self.attempts):
+            self.drain()
+            if self.probe():
+                self.dirty = False
+                self.last_recovery = time.time() - start
+                return True
+            self.counters['probe_failures'] += 1
+        self.dirty = True
+        self.last_recovery = time.time() - start
+        return False
@@ -0,0 +1,179 @@
+import threading
+import time
+
+
+# Manual control channel
+# Joystick and web-pad front ends report every input event. ManualControl keeps the
+# desired motion per axis and the desired slew rate, and a worker thread sends only
+# the transitions between what the mount was last told and what is wanted now:
+#   - bursts of events within `window` seconds collapse into one update
+#   - halts are never delayed: a release or stop wakes the worker immediately
+#   - each update sends halts first, then the rate change, then new moves, and
+#     re-issues moves still in progress after a rate change so they pick it up
+# Input-to-motion latency is therefore at most `window` plus one round of commands.
+# `sent` only changes for commands that went out. When the port fails part way through an
+# update, the worker sends halt_all() if anything may still be moving, keeps running and
+# retries every `retry` seconds, so a release or halt cannot be lost to a port error.
+
+AXES = {
+    'north': ('ns', 1), 'south': ('ns', -1),
+    'east': ('ew', 1), 'west': ('ew', -1),
+}
+MOVES = {('ns', 1): 'slew_north', ('ns', -1): 'slew_south', ('ew', 1): 'slew_east', ('ew', -1): 'slew_west'}
+HALTS = {('ns', 1): 'halt_north', ('ns', -1): 'halt_south', ('ew', 1): 'halt_east', ('ew', -1): 'halt_west'}
+RATES = {
+    'guide': 'set_slew_rate_min', 'center': 'set_slew_rate_center',
+    'find': 'set_slew_rate_find', 'max': 'set_slew_rate_max',
+}
+
+
+class ManualControl(threading.Thread):
+    def __init__(self, scope, window=0.05):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scope = scope
+        self.window = window
+        self.condition = threading.Condition()
+        self.desired = {'ns': 0, 'ew': 0}
+        self.sent = {'ns': 0, 'ew': 0}
+        self.rate = None
+        self.sent_rate = None
+        self.dirty = False
+        self.urgent = False
+        self.stopped = False
+        self.events = 0
+        self.commands = 0
+        self.updates = 0
+        self.errors = 0
+        self.last_error = None
+        self.retry = 0.5
+
+    # input side, safe to call from any thread
+    def press(self, direction):
+        axis, sign = AXES[direction]
+        with self.condition:
+            self.events += 1
+            self.desired[axis] = sign
+            self.urgent = self.urgent or self.sent[axis] not in (0, sign)
+            self.dirty = True
+            self.condition.notify()
+
+    def release(self, direction):
+        axis, sign = AXES[direction]
+        with self.condition:
+            self.events += 1
+            if self.desired[axis] == sign:
+                self.desired[axis] = 0
+                # only a move the mount has actually been given needs a halt right now
+                self.urgent = self.urgent or self.sent[axis] == sign
+            self.dirty = True
+            self.condition.notify()
+
+    def set_rate(self, rate):
+        assert rate in RATES, 'rate is one of {}'.format(', '.join(sorted(RATES)))
+        with self.condition:
+            self.events += 1
+            self.rate = rate
+            self.dirty = True
+            self.condition.notify()
+
+    def halt(self):
+        # stop both axes right away
+        with self.condition:
+            self.events += 1
+            self.desired = {'ns': 0, 'ew': 0}
+            self.dirty = self.urgent = True
+            self.condition.notify()
+
+    def close(self):
+        self.halt()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    # worker side
+    def _plan(self):
+        # (command, axis, value) steps taking the mount from `sent` to `desired`, halts first;
+        # axis None marks the rate change
+        halts, moves = [], []
+        for axis in ('ns', 'ew'):
+            want, have = self.desired[axis], self.sent[axis]
+            if have and want != have:
+                halts.append((HALTS[(axis, have)], axis, 0))
+        rate = []
+        if self.rate is not None and self.rate != self.sent_rate:
+            rate = [(RATES[self.rate], None, self.rate)]
+        for axis in ('ns', 'ew'):
+            want, have = self.desired[axis], self.sent[axis]
+            if want and (want != have or rate):
+                moves.append((MOVES[(axis, want)], axis, want))
+        return halts + rate + moves
+
+    def _sent(self, axis, value):
+        with self.condition:
+            if axis is None:
+                self.sent_rate = value
+            else:
+                self.sent[axis] = value
+
+    def update(self):
+        with self.condition:
+            steps = self._plan()
+            self.dirty = self.urgent = False
+        commands = []
+        step = None
+        try:
+            if steps:
+                with self.scope.lock:
+                    for step in steps:
+                        name, axis, value = step
+                        getattr(self.scope, name)()
+                        # `sent` only records what actually went out
+                        self._sent(axis, value)
+                        commands.append(name)
+        except (IOError, OSError) as e:
+            self.errors += 1
+            self.last_error = e
+            self._recover(step)
+            raise
+        finally:
+            self.commands += len(commands)
+            self.updates += 1
+        return commands
+
+    def _recover(self, step):
+        # `step` failed and may or may not have reached the mount: stop everything with
+        # halt_all(), then plan the rest again from a mount known to be still.
+        with self.condition:
+            self.dirty = self.urgent = True
+        try:
+            with self.scope.lock:
+                self.scope.halt_all()
+            with self.condition:
+                self.sent = {'ns': 0, 'ew': 0}
+        except (IOError, OSError):
+            name, axis, value = step
+            if axis is not None and value:
+                # assume the move got through, so its halt is part of the retry
+                self._sent(axis, value)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.dirty and not self.stopped:
+                    self.condition.wait()
+                if self.stopped and not self.dirty:
+                    return
+                # collect the rest of the burst unless a halt is waiting
+                deadline = time.time() + self.window
+                while not self.urgent and not self.stopped:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            try:
+                self.update()
+            except (IOError, OSError):
+                # the port is down: keep the channel alive and try again shortly, so a
+                # pending halt is never dropped
+                time.sleep(self.retry)
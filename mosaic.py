@@ -0,0 +1,144 @@
+import math
+import threading
+import time
+
+import catalog
+
+
+# Mosaic / survey planning
+# Tile centres are laid out on the tangent plane around the field centre and projected
+# back to the sphere (gnomonic), so RA wrap-around and fields near or over a pole need no
+# special cases. Rows are visited serpentine-style so consecutive tiles are neighbours.
+# run() overlaps slewing with imaging: while tile n is being exposed, tile n+1 is
+# already uploaded with :Sr/:Sd, leaving only :MS# and the slew between exposures.
+
+class Tile(object):
+    __slots__ = ('index', 'row', 'col', 'ra', 'dec')
+
+    def __init__(self, index, row, col, ra, dec):
+        self.index = index
+        self.row = row
+        self.col = col
+        self.ra = ra
+        self.dec = dec
+
+    def __repr__(self):
+        return 'Tile({}, row={}, col={}, ra={:.4f}, dec={:.3f})'.format(
+            self.index, self.row, self.col, self.ra, self.dec)
+    # ra in hours, dec in degrees
+
+
+def _deproject(ra0, dec0, xi, eta):
+    # gnomonic tangent-plane offsets (radians, xi towards +RA, eta towards +Dec) -> (ra hours, dec degrees)
+    a0 = math.radians(ra0 * 15.0)
+    d0 = math.radians(dec0)
+    rho = math.hypot(xi, eta)
+    c = math.atan(rho)
+    if rho == 0:
+        return ra0 % 24.0, dec0
+    sin_c, cos_c = math.sin(c), math.cos(c)
+    dec = math.asin(cos_c * math.sin(d0) + eta * sin_c * math.cos(d0) / rho)
+    ra = a0 + math.atan2(xi * sin_c, rho * math.cos(d0) * cos_c - eta * math.sin(d0) * sin_c)
+    return (math.degrees(ra) / 15.0) % 24.0, math.degrees(dec)
+
+def _count(size, fov, step):
+    return max(1, int(math.ceil((size - fov) / step - 1e-9)) + 1)
+
+def plan(ra, dec, width, height, fov_width, fov_height, overlap=0.1):
+    # Tiles covering width x height degrees around (ra hours, dec degrees) with a camera
+    # field of fov_width x fov_height degrees and `overlap` as a fraction of the field.
+    assert 0.0 <= overlap < 1.0
+    step_x = fov_width * (1.0 - overlap)
+    step_y = fov_height * (1.0 - overlap)
+    cols = _count(width, fov_width, step_x)
+    rows = _count(height, fov_height, step_y)
+    tiles = []
+    for row in range(rows):
+        eta = math.radians((row - (rows - 1) / 2.0) * step_y)
+        order = range(cols) if row % 2 == 0 else range(cols - 1, -1, -1)
+        for col in order:
+            xi = math.radians((col - (cols - 1) / 2.0) * step_x)
+            tile_ra, tile_dec = _deproject(ra, dec, math.tan(xi), math.tan(eta))
+            tiles.append(Tile(len(tiles), row, col, tile_ra, tile_dec))
+    return tiles
+
+
+def wait_for_slew(scope, poll=0.25, timeout=300.0):
+    # :D# returns a bar while the slew is in progress and an empty string once it is done
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with scope.lock:
+            bars = scope.get_distance_bars()
+        if not bars.strip().rstrip('#').strip():
+            return True
+        time.sleep(poll)
+    return False
+
+
+class MosaicRun(object):
+    def __init__(self, scope, tiles, expose, settle=2.0):
+        # expose(tile) takes the exposure and returns when it is done
+        self.scope = scope
+        self.tiles = tiles
+        self.expose = expose
+        self.settle = settle
+        self.done = []
+        self.failed = []
+        self.started = None
+        self.finished = None
+
+    def _goto(self, tile):
+        with self.scope.lock:
+            response = self.scope.slew_to_obj()
+        # only '0' accepts the goto; an empty reply is a lost one, not a success
+        if response.strip().startswith('0'):
+            if wait_for_slew(self.scope):
+                time.sleep(self.settle)
+                return True
+        self.failed.append((tile, response.strip().rstrip('#')))
+        return False
+
+    def _upload(self, tile):
+        # :Sr/:Sd answer '1' when accepted; otherwise :MS# would slew back to the previous tile
+        with self.scope.lock:
+            replies = catalog.set_target_coords(self.scope, tile.ra, tile.dec)
+        return all(reply.strip().startswith('1') for reply in replies)
+
+    def _expose(self, tile, errors):
+        try:
+            self.expose(tile)
+        except Exception as e:
+            errors.append(e)
+
+    def run(self):
+        self.started = time.time()
+        if not self.tiles:
+            return self
+        uploaded = self._upload(self.tiles[0])
+        for n, tile in enumerate(self.tiles):
+            following = self.tiles[n + 1] if n + 1 < len(self.tiles) else None
+            if not uploaded:
+                self.failed.append((tile, 'target rejected'))
+            elif self._goto(tile):
+                errors = []
+                exposure = threading.Thread(target=self._expose, args=(tile, errors))
+                exposure.start()
+                if following is not None:
+                    # upload the next target while the shutter is open
+                    uploaded = self._upload(following)
+                exposure.join()
+                if errors:
+                    # the camera failed: the tile is not done, and the run stops here
+                    self.failed.append((tile, str(errors[0])))
+                    self.finished = time.time()
+                    raise errors[0]
+                self.done.append(tile)
+                continue
+            if following is not None:
+                uploaded = self._upload(following)
+        self.finished = time.time()
+        return self
+
+    def tiles_per_hour(self):
+        elapsed = (self.finished or time.time()) - self.started
+        return len(self.done) * 3600.0 / elapsed if elapsed > 0 else 0.0
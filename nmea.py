@@ -0,0 +1,140 @@
+# NMEA 0183 sentence parsing for the LX200GPS :gps# stream
+# Only GGA (fix) and RMC (time/date) are decoded; everything else is passed over.
+# Sentences look like $GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47
+
+
+class GgaFix(object):
+    __slots__ = ('time', 'lat', 'lon', 'quality', 'satellites', 'hdop', 'altitude')
+
+    def __init__(self, time, lat, lon, quality, satellites, hdop, altitude):
+        self.time = time
+        self.lat = lat
+        self.lon = lon
+        self.quality = quality
+        self.satellites = satellites
+        self.hdop = hdop
+        self.altitude = altitude
+
+    def __repr__(self):
+        return 'GgaFix(time={!r}, lat={!r}, lon={!r}, quality={}, satellites={}, altitude={!r})'.format(
+            self.time, self.lat, self.lon, self.quality, self.satellites, self.altitude)
+    # time as (hh, mm, ss.sss) UTC, lat/lon in decimal degrees (East positive), altitude in metres
+
+
+class RmcFix(object):
+    __slots__ = ('time', 'date', 'valid', 'lat', 'lon')
+
+    def __init__(self, time, date, valid, lat, lon):
+        self.time = time
+        self.date = date
+        self.valid = valid
+        self.lat = lat
+        self.lon = lon
+
+    def __repr__(self):
+        return 'RmcFix(time={!r}, date={!r}, valid={}, lat={!r}, lon={!r})'.format(
+            self.time, self.date, self.valid, self.lat, self.lon)
+    # date as (yyyy, mm, dd) UTC
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def checksum(body):
+    value = 0
+    for ch in body:
+        value ^= ord(ch)
+    return value
+
+def _time(field):
+    if not field:
+        return None
+    return (int(field[0:2]), int(field[2:4]), float(field[4:]))
+
+def _coord(field, hemi, degree_digits):
+    # ddmm.mmmm / dddmm.mmmm -> decimal degrees
+    if not field:
+        return None
+    value = int(field[:degree_digits]) + float(field[degree_digits:]) / 60.0
+    return -value if hemi in ('S', 'W') else value
+
+def parse_sentence(line, require_checksum=True):
+    # Returns a GgaFix, an RmcFix or None for sentences we do not decode.
+    # Raises ChecksumError when the '*hh' checksum does not match, and when a GGA/RMC
+    # sentence has none (a truncated reply loses exactly that tail) unless require_checksum is off.
+    line = line.strip().rstrip('#')
+    if not line.startswith('$'):
+        return None
+    star = line.find('*')
+    if star >= 0:
+        body = line[1:star]
+        try:
+            expected = int(line[star + 1:star + 3], 16)
+        except ValueError:
+            raise ChecksumError(line)
+        if checksum(body) != expected:
+            raise ChecksumError(line)
+    else:
+        body = line[1:]
+    kind = body[2:5]
+    if star < 0 and require_checksum and kind in ('GGA', 'RMC'):
+        raise ChecksumError(line)
+    if kind == 'GGA':
+        f = body.split(',')
+        if len(f) < 10:
+            return None
+        return GgaFix(_time(f[1]),
+                      _coord(f[2], f[3], 2),
+                      _coord(f[4], f[5], 3),
+                      int(f[6] or 0),
+                      int(f[7] or 0),
+                      float(f[8]) if f[8] else None,
+                      float(f[9]) if f[9] else None)
+    if kind == 'RMC':
+        f = body.split(',')
+        if len(f) < 10:
+            return None
+        date = f[9]
+        return RmcFix(_time(f[1]),
+                      (2000 + int(date[4:6]), int(date[2:4]), int(date[0:2])) if date else None,
+                      f[2] == 'A',
+                      _coord(f[3], f[4], 2),
+                      _coord(f[5], f[6], 3))
+    return None
+
+
+class NmeaParser(object):
+    # Incremental parser: feed() arbitrary chunks, get back decoded fixes.
+    # Partial sentences are carried over to the next feed(); bad or garbled sentences are counted and dropped.
+
+    def __init__(self, require_checksum=True):
+        self.require_checksum = require_checksum
+        self.buffer = ''
+        self.errors = 0
+
+    def feed(self, data):
+        self.buffer += data
+        fixes = []
+        start = 0
+        while True:
+            end = self._next_end(start)
+            if end < 0:
+                break
+            line = self.buffer[start:end]
+            start = end + 1
+            if not line.strip():
+                continue
+            try:
+                fix = parse_sentence(line, self.require_checksum)
+            except ValueError:
+                self.errors += 1
+                continue
+            if fix is not None:
+                fixes.append(fix)
+        self.buffer = self.buffer[start:]
+        return fixes
+
+    def _next_end(self, start):
+        ends = [i for i in (self.buffer.find('\n', start), self.buffer.find('#', start)) if i >= 0]
+        return min(ends) if ends else -1
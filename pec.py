@@ -0,0 +1,149 @@
+import math
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import telemetry
+
+
+# Periodic error measurement for the $Q – Smart Drive (PEC) controls
+# PecCapture samples a drift source (by default :GR# while tracking) on a fixed
+# schedule: sample k is due at start + k * cadence and is never shifted by a slow
+# round trip, late slots are skipped rather than bunched up, and every sample keeps
+# its scheduled time so the cadence jitter can be reported. analyse() detrends the
+# series, finds the dominant period with an FFT and refines period and amplitude with
+# a sinusoid fit. compare_pec() runs the capture with RA PEC off and then on.
+
+class PecSample(object):
+    __slots__ = ('t', 'scheduled', 'value')
+    fields = __slots__
+
+    def __init__(self, t, scheduled, value):
+        self.t = t
+        self.scheduled = scheduled
+        self.value = value
+
+    def __iter__(self):
+        return iter((self.t, self.scheduled, self.value))
+    # t is the midpoint of the query round trip, value in arcseconds of RA
+
+
+def tel_ra_arcsec(scope):
+    # :GR# in arcseconds (use high precision, HH:MM:SS, for 15" steps)
+    return telemetry.parse_ra(scope.get_tel_ra()) * 54000.0
+
+
+class PecCapture(object):
+    def __init__(self, scope, cadence=1.0, source=tel_ra_arcsec, spin=0.002):
+        self.scope = scope
+        self.cadence = cadence
+        self.source = source
+        self.spin = spin
+        self.series = telemetry.TelemetrySeries(PecSample)
+        self.missed = 0
+
+    def _wait_until(self, deadline):
+        # sleep most of the way, then spin the last couple of milliseconds
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while time.perf_counter() < deadline:
+            pass
+
+    def run(self, duration):
+        clock_offset = time.time() - time.perf_counter()
+        start = time.perf_counter() + self.cadence
+        slots = int(duration / self.cadence)
+        k = 0
+        while k < slots:
+            due = start + k * self.cadence
+            self._wait_until(due)
+            with self.scope.lock:
+                t0 = time.perf_counter()
+                value = self.source(self.scope)
+                t1 = time.perf_counter()
+            self.series.append((clock_offset + (t0 + t1) / 2, clock_offset + due, value))
+            # skip slots that already passed instead of firing them back to back
+            late = int((time.perf_counter() - start) / self.cadence) + 1
+            if late > k + 1:
+                self.missed += late - k - 1
+            k = max(k + 1, late)
+        return self.series
+
+    def jitter(self):
+        # (mean, rms, worst) of sample time minus scheduled time, in seconds
+        error = [t - s for t, s in zip(self.series.column('t'), self.series.column('scheduled'))]
+        if not error:
+            return 0.0, 0.0, 0.0
+        mean = sum(error) / len(error)
+        rms = math.sqrt(sum(e * e for e in error) / len(error))
+        return mean, rms, max(error, key=abs)
+
+
+class PecResult(object):
+    __slots__ = ('period', 'amplitude', 'phase', 'rms', 'frequencies', 'spectrum')
+
+    def __init__(self, period, amplitude, phase, rms, frequencies, spectrum):
+        self.period = period
+        self.amplitude = amplitude
+        self.phase = phase
+        self.rms = rms
+        self.frequencies = frequencies
+        self.spectrum = spectrum
+
+    def __repr__(self):
+        return 'PecResult(period={:.1f} s, amplitude={:.2f}", rms={:.2f}")'.format(
+            self.period, self.amplitude, self.rms)
+    # amplitude is the semi-amplitude of the fitted sinusoid, rms of the detrended error
+
+
+def _sine_fit(t, y, period):
+    design = np.column_stack([np.sin(2 * np.pi * t / period), np.cos(2 * np.pi * t / period), np.ones_like(t)])
+    solution, residual = np.linalg.lstsq(design, y, rcond=None)[:2]
+    return solution, (residual[0] if len(residual) else float(np.sum((y - design.dot(solution)) ** 2)))
+
+def analyse(series, min_period=60.0, max_period=None):
+    if np is None:
+        raise ImportError('numpy is required for pec.analyse')
+    t = np.frombuffer(series.column('scheduled'), dtype=np.float64)
+    y = np.frombuffer(series.column('value'), dtype=np.float64)
+    t = t - t[0]
+    # remove sidereal drift / tracking rate error, then put missed slots back on the grid
+    y = y - np.polyval(np.polyfit(t, y, 1), t)
+    step = float(np.median(np.diff(t)))
+    grid = np.arange(0.0, t[-1] + step / 2, step)
+    uniform = np.interp(grid, t, y)
+    window = np.hanning(len(uniform))
+    spectrum = np.abs(np.fft.rfft(uniform * window)) * 2.0 / window.sum()
+    frequencies = np.fft.rfftfreq(len(uniform), step)
+    if max_period is None:
+        max_period = t[-1] / 2.0
+    band = (frequencies >= 1.0 / max_period) & (frequencies <= 1.0 / min_period)
+    assert band.any(), 'capture too short for periods of {:.0f}..{:.0f} s'.format(min_period, max_period)
+    peak = frequencies[band][np.argmax(spectrum[band])]
+    # refine around the FFT bin, which is coarse for only a few worm cycles
+    resolution = frequencies[1]
+    candidates = 1.0 / np.linspace(max(peak - resolution, resolution / 4), peak + resolution, 201)
+    best = min(candidates, key=lambda p: _sine_fit(t, y, p)[1])
+    (a, b, _), _ = _sine_fit(t, y, best)
+    return PecResult(float(best), float(math.hypot(a, b)), float(math.atan2(b, a)),
+                     float(np.sqrt(np.mean(y ** 2))), frequencies, spectrum)
+
+
+def compare_pec(scope, duration, cadence=1.0, source=tel_ra_arcsec, settle=5.0):
+    # Capture with RA PEC disabled, then enabled. Returns (off, on, improvement factor in rms).
+    results = []
+    for enable in (False, True):
+        with scope.lock:
+            if enable:
+                scope.enable_pec_ra()
+            else:
+                scope.disable_pec_ra()
+        time.sleep(settle)
+        capture = PecCapture(scope, cadence, source)
+        results.append(analyse(capture.run(duration)))
+    off, on = results
+    return off, on, off.rms / on.rms if on.rms else float('inf')
@@ -0,0 +1,128 @@
+import json
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import catalog
+import telemetry
+
+
+# Pointing model from sync residuals
+# Every sync tells us where the mount thought it was (before) and where it really was
+# (after). Those pairs are fitted to the classic six-term equatorial model
+#   dH = IH + CH sec(d) + NP tan(d) + MA cos(h) tan(d) - ME sin(h) tan(d)
+#   dd = ID + MA sin(h) + ME cos(h)
+# with h the hour angle, d the declination and dH/dd the mount reading minus the true
+# position: index errors (IH, ID), collimation (CH), axis non-perpendicularity (NP) and
+# polar axis misalignment (MA, ME). correct() then turns a wanted position into the
+# coordinates to upload with set_target_ra/set_target_dec.
+#
+# A sync re-zeroes the handset's frame at the synced position. Treating that as a pure
+# index shift, the residual of an earlier sync in the current frame is the sum of the
+# shifts applied by every later sync, which is what fit() uses.
+
+TERMS = ('IH', 'ID', 'CH', 'NP', 'MA', 'ME')
+
+
+def _hour_angle(lst, ra):
+    # hours, folded into [-12, 12)
+    return (lst - ra + 12.0) % 24.0 - 12.0
+
+
+class PointingModel(object):
+    def __init__(self):
+        # per sync: lst (hours), true ra/dec, shift in ha/dec (degrees)
+        self.records = []
+        self.terms = dict.fromkeys(TERMS, 0.0)
+        self.rms = None
+
+    def record(self, lst, before, after):
+        # before/after are (ra hours, dec degrees) read around a sync
+        shift_ha = -_hour_angle(after[0], before[0]) * 15.0
+        shift_dec = after[1] - before[1]
+        self.records.append((lst, after[0], after[1], shift_ha, shift_dec))
+    # shift_ha is in hour-angle degrees: the mount read RA `before` and was told RA `after`
+
+    def record_sync(self, scope, selenographic=False):
+        # Read the mount position around :CM# (or :CL#) and record the pair
+        with scope.lock:
+            lst = telemetry.parse_hms(scope.get_lst()) / 3600.0
+            before = (telemetry.parse_ra(scope.get_tel_ra()), telemetry.parse_dms(scope.get_telescope_dec()))
+            response = scope.sync_selenographic() if selenographic else scope.sync_object()
+            after = (telemetry.parse_ra(scope.get_tel_ra()), telemetry.parse_dms(scope.get_telescope_dec()))
+        self.record(lst, before, after)
+        return response
+
+    def _design(self, h, d):
+        # rows for dH*cos(d) and dd, so the sec/tan terms stay finite towards the pole
+        zero = np.zeros_like(h)
+        one = np.ones_like(h)
+        sin_d, cos_d = np.sin(d), np.cos(d)
+        ha_rows = np.column_stack([cos_d, zero, one, sin_d, np.cos(h) * sin_d, -np.sin(h) * sin_d])
+        dec_rows = np.column_stack([zero, one, zero, zero, np.sin(h), np.cos(h)])
+        return ha_rows, dec_rows
+
+    def residuals(self):
+        # (h radians, d radians, dH degrees, dd degrees) of every record in the current frame
+        data = np.array(self.records, dtype=float).reshape(-1, 5)
+        lst, ra, dec, shift_ha, shift_dec = data.T
+        later_ha = np.concatenate([np.cumsum(shift_ha[::-1])[::-1][1:], [0.0]])
+        later_dec = np.concatenate([np.cumsum(shift_dec[::-1])[::-1][1:], [0.0]])
+        h = np.radians(_hour_angle(lst, ra) * 15.0)
+        return h, np.radians(dec), later_ha, later_dec
+
+    def fit(self, terms=TERMS):
+        # Least-squares fit of the chosen terms; returns the rms of the fit residuals in arcsec
+        if np is None:
+            raise ImportError('numpy is required for PointingModel.fit')
+        h, d, dha, ddec = self.residuals()
+        ha_rows, dec_rows = self._design(h, d)
+        columns = [TERMS.index(term) for term in terms]
+        design = np.vstack([ha_rows, dec_rows])[:, columns]
+        observed = np.concatenate([dha * np.cos(d), ddec])
+        assert len(observed) >= len(columns), 'need at least {} syncs to fit {}'.format(
+            (len(columns) + 1) // 2, ', '.join(terms))
+        solution = np.linalg.lstsq(design, observed, rcond=None)[0]
+        self.terms = dict.fromkeys(TERMS, 0.0)
+        self.terms.update(zip(terms, solution.tolist()))
+        self.rms = float(np.sqrt(np.mean((observed - design.dot(solution)) ** 2)) * 3600.0)
+        return self.rms
+
+    def offsets(self, ha, dec):
+        # model (dH, dd) in degrees at hour angle `ha` (hours) and `dec` (degrees)
+        t = self.terms
+        h = math.radians(ha * 15.0)
+        d = math.radians(dec)
+        sec_d = 1.0 / max(math.cos(d), 1e-6)
+        tan_d = math.tan(d)
+        dh = t['IH'] + t['CH'] * sec_d + t['NP'] * tan_d + (t['MA'] * math.cos(h) - t['ME'] * math.sin(h)) * tan_d
+        dd = t['ID'] + t['MA'] * math.sin(h) + t['ME'] * math.cos(h)
+        return dh, dd
+
+    def correct(self, ra, dec, lst):
+        # Mount-frame (ra hours, dec degrees) that makes the scope land on the true (ra, dec)
+        dh, dd = self.offsets(_hour_angle(lst, ra), dec)
+        return (ra - dh / 15.0) % 24.0, max(-90.0, min(90.0, dec + dd))
+
+    def set_target(self, scope, ra, dec):
+        # Pre-corrected :Sr/:Sd upload of a true position
+        with scope.lock:
+            lst = telemetry.parse_hms(scope.get_lst()) / 3600.0
+            return catalog.set_target_coords(scope, *self.correct(ra, dec, lst))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'records': self.records, 'terms': self.terms, 'rms': self.rms}, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        model = cls()
+        model.records = [tuple(r) for r in data['records']]
+        model.terms.update(data['terms'])
+        model.rms = data.get('rms')
+        return model
@@ -0,0 +1,141 @@
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import telemetry
+
+
+# Shared-memory telemetry
+# The process that owns the Autostar publishes decoded mount state into a named
+# multiprocessing.shared_memory block; guider, GUI and logger processes attach to
+# it and read snapshots without syscalls or serial traffic.
+#
+# Layout: an 8 byte seqlock counter followed by the payload doubles. The writer makes
+# the counter odd, writes the payload and makes it even again; a reader retries until
+# it sees the same even counter before and after copying the payload.
+# Readers are meant to live in other processes: a Reader in the publishing process
+# unregisters the block from the shared resource tracker on Python < 3.13.
+
+FIELDS = ('t', 'ra', 'dec', 'alt', 'az', 'lst', 'tracking_rate', 'tube_temp', 'slewing')
+COUNTER = struct.Struct('<Q')
+PAYLOAD = struct.Struct('<{:d}d'.format(len(FIELDS)))
+SIZE = COUNTER.size + PAYLOAD.size
+NAME = 'honeypi-telemetry'
+
+
+class State(object):
+    __slots__ = ('sequence',) + FIELDS
+
+    def __init__(self, sequence, *values):
+        self.sequence = sequence
+        for name, value in zip(FIELDS, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return 'State(sequence={}, {})'.format(
+            self.sequence, ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in FIELDS))
+    # sequence counts publications (0 = nothing published yet); units as in telemetry.py,
+    # slewing is 1.0 while a goto is in progress
+
+
+class Publisher(object):
+    def __init__(self, name=NAME):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        except FileExistsError:
+            # left over from a crashed owner; take it over
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+        self.counter = 0
+        COUNTER.pack_into(self.buf, 0, 0)
+        self.values = dict.fromkeys(FIELDS, float('nan'))
+
+    def publish(self, **values):
+        # Fields not passed keep their last published value.
+        self.values.update(values)
+        self.counter += 1
+        COUNTER.pack_into(self.buf, 0, self.counter)
+        PAYLOAD.pack_into(self.buf, COUNTER.size, *[self.values[name] for name in FIELDS])
+        self.counter += 1
+        COUNTER.pack_into(self.buf, 0, self.counter)
+
+    def close(self, unlink=True):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Reader(object):
+    def __init__(self, name=NAME):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 registers attached blocks with the resource tracker, which would
+            # unlink the publisher's block when this process exits
+            self.shm = shared_memory.SharedMemory(name=name)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.buf = self.shm.buf
+        self.retries = 0
+
+    def snapshot(self, max_retries=100000):
+        buf = self.buf
+        for _ in range(max_retries):
+            before = COUNTER.unpack_from(buf, 0)[0]
+            if before & 1:
+                self.retries += 1
+                continue
+            values = PAYLOAD.unpack_from(buf, COUNTER.size)
+            if COUNTER.unpack_from(buf, 0)[0] == before:
+                return State(before // 2, *values)
+            self.retries += 1
+        raise RuntimeError('publisher stalled in the middle of an update')
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+class TelemetryPump(threading.Thread):
+    # Polls the mount in the owning process and publishes every reading. Position is read
+    # every `interval` seconds; the slower status fields (LST, tracking rate, tube temperature,
+    # slew state) every `status_every` cycles. Each group is read under the port lock.
+
+    def __init__(self, scope, publisher, interval=0.5, status_every=4):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scope = scope
+        self.publisher = publisher
+        self.interval = interval
+        self.status_every = status_every
+        self.stopped = threading.Event()
+        self.errors = 0
+
+    def poll(self, cycle):
+        with self.scope.lock:
+            position = telemetry.sample_position(self.scope)
+        values = dict(zip(telemetry.PositionSample.fields, position))
+        if cycle % self.status_every == 0:
+            with self.scope.lock:
+                status = telemetry.sample_status(self.scope)
+                bars = self.scope.get_distance_bars()
+            values.update(zip(telemetry.StatusSample.fields[1:], tuple(status)[1:]))
+            values['slewing'] = 1.0 if bars.strip().rstrip('#').strip() else 0.0
+        self.publisher.publish(**values)
+
+    def run(self):
+        cycle = 0
+        while not self.stopped.is_set():
+            start = time.time()
+            try:
+                self.poll(cycle)
+            except (ValueError, IndexError, IOError, OSError):
+                # garbled reply or port outage (connection.ConnectionLost): skip this cycle
+                self.errors += 1
+            cycle += 1
+            self.stopped.wait(max(0.0, self.interval - (time.time() - start)))
+
+    def stop(self):
+        self.stopped.set()
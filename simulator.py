@@ -0,0 +1,341 @@
+import heapq
+import random
+import threading
+import time
+
+from control import split_command
+
+
+# Simulated handset
+# An in-process stand-in for the serial port that answers the LX200/Autostar commands
+# Autostar sends, with just enough mount state (position, target, slews, focuser,
+# browse settings) for telemetry, gotos, jogs and setters to behave plausibly.
+# Replies are delivered in order after `latency` seconds; with probability
+# `spike_rate` a reply is held back by up to `spike` seconds (so it can miss the
+# reader's timeout and arrive late), and with probability `drop_rate` one byte of it
+# is lost. `speed` shortens slews for accelerated soak runs. unplug()/plug() make reads
+# and writes fail like a USB-serial adapter that went away, and power_cycle(downtime)
+# ignores commands for `downtime` seconds and then answers from its power-on state.
+
+SIDEREAL = 1.00273790935
+
+
+def _hms(hours):
+    seconds = int(round((hours % 24.0) * 3600.0)) % 86400
+    return '{:02d}:{:02d}:{:02d}#'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def _dms(degrees, width=2, signed=True):
+    sign = '-' if degrees < 0 else '+'
+    seconds = int(round(abs(degrees) * 3600.0))
+    text = '{:0{}d}*{:02d}:{:02d}#'.format(seconds // 3600, width, seconds // 60 % 60, seconds % 60)
+    return (sign if signed else '') + text
+
+def _hms_value(text):
+    hh, mm, ss = [float(x) for x in text.split(':')]
+    return hh + mm / 60.0 + ss / 3600.0
+
+def _dms_value(text):
+    sign = -1.0 if text.startswith('-') else 1.0
+    parts = text.lstrip('+-').replace('*', ':').replace("'", ':').split(':')
+    value = 0.0
+    for n, part in enumerate(parts):
+        value += float(part) / 60.0 ** n
+    return sign * value
+
+
+class SimulatedPort(object):
+    def __init__(self, latency=0.002, spike_rate=0.0, spike=1.5, drop_rate=0.0, speed=1.0,
+                 slew_time=20.0, timeout=1.0, seed=None):
+        self.latency = latency
+        self.spike_rate = spike_rate
+        self.spike = spike
+        self.drop_rate = drop_rate
+        self.speed = speed
+        self.slew_time = slew_time
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.condition = threading.Condition()
+        self.inflight = []
+        self.sequence = 0
+        self.last_delivery = 0.0
+        self.received = bytearray()
+        self.partial = ''
+        self.counters = {'commands': 0, 'spikes': 0, 'drops': 0}
+        self.connected = True
+        self.power_cycle()
+
+    def power_cycle(self, downtime=0.0):
+        with self.condition:
+            del self.inflight[:]
+            del self.received[:]
+            self.partial = ''
+            self.powered_at = time.time() + downtime
+            self.state = self._power_on()
+
+    def _power_on(self):
+        return {
+            'ra': 5.5, 'dec': 20.0, 'target_ra': 0.0, 'target_dec': 0.0,
+            'slew_from': None, 'slew_start': 0.0, 'moving': set(), 'moved_at': time.time(),
+            'focus': 0, 'temp': 12.5,
+            'bright': -2.0, 'faint': 12.0, 'size_min': 0, 'size_max': 200, 'field': 15,
+            'classes': 'GPDCO', 'quality': 'GD', 'lat': 39.17, 'long': 86.53, 'utc': 5.0,
+            'rate': 60.1, 'lst0': time.time(), 'mount': 'A', 'site': 0, 'tracking': 'TQ',
+            'high': True, 'pointing': False,
+        }
+
+    def unplug(self):
+        self.connected = False
+
+    def plug(self):
+        self.connected = True
+
+    def _check(self):
+        if not self.connected:
+            raise IOError('device disconnected')
+
+    # port interface used by Autostar / FramedPort
+    def write(self, data):
+        self._check()
+        if isinstance(data, bytes):
+            data = data.decode('latin-1')
+        with self.condition:
+            self._handle_input(data)
+        return len(data)
+
+    def _handle_input(self, data):
+        if time.time() < self.powered_at:
+            return
+        self.partial += data
+        while self.partial:
+            if self.partial[0] == '\x06':
+                command, self.partial = '\x06', self.partial[1:]
+            elif '#' in self.partial:
+                command, self.partial = self.partial.split('#', 1)
+                command += '#'
+            else:
+                break
+            self.counters['commands'] += 1
+            reply = self.handle(command)
+            if reply:
+                self._schedule(reply)
+
+    def _schedule(self, reply):
+        delay = self.latency
+        if self.random.random() < self.spike_rate:
+            delay += self.random.uniform(0.2, 1.0) * self.spike
+            self.counters['spikes'] += 1
+        if self.random.random() < self.drop_rate:
+            lost = self.random.randrange(len(reply))
+            reply = reply[:lost] + reply[lost + 1:]
+            self.counters['drops'] += 1
+        due = max(time.time() + delay, self.last_delivery)
+        self.last_delivery = due
+        self.sequence += 1
+        heapq.heappush(self.inflight, (due, self.sequence, reply.encode('latin-1')))
+        self.condition.notify_all()
+
+    def _deliver(self):
+        now = time.time()
+        while self.inflight and self.inflight[0][0] <= now:
+            self.received.extend(heapq.heappop(self.inflight)[2])
+
+    def read(self, size=1):
+        self._check()
+        deadline = time.time() + self.timeout
+        with self.condition:
+            while True:
+                self._deliver()
+                if len(self.received) >= size:
+                    break
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+                if self.inflight:
+                    wait = min(wait, max(0.0, self.inflight[0][0] - time.time()))
+                self.condition.wait(wait)
+            data = bytes(self.received[:size])
+            del self.received[:size]
+            return data
+
+    def read_until(self, terminator=b'#'):
+        self._check()
+        deadline = time.time() + self.timeout
+        with self.condition:
+            while True:
+                self._deliver()
+                end = self.received.find(terminator)
+                if end >= 0:
+                    data = bytes(self.received[:end + 1])
+                    del self.received[:end + 1]
+                    return data
+                wait = deadline - time.time()
+                if wait <= 0:
+                    data = bytes(self.received)
+                    del self.received[:]
+                    return data
+                if self.inflight:
+                    wait = min(wait, max(0.0, self.inflight[0][0] - time.time()))
+                self.condition.wait(wait)
+
+    def readline(self):
+        return self.read_until().decode('latin-1')
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self._deliver()
+            del self.received[:]
+
+    def close(self):
+        pass
+
+    # handset model
+    def _position(self):
+        s = self.state
+        if s['slew_from'] is not None:
+            progress = (time.time() - s['slew_start']) * self.speed / self.slew_time
+            if progress >= 1.0:
+                s['ra'], s['dec'] = s['target_ra'], s['target_dec']
+                s['slew_from'] = None
+            else:
+                ra0, dec0 = s['slew_from']
+                s['ra'] = ra0 + (((s['target_ra'] - ra0 + 12.0) % 24.0) - 12.0) * progress
+                s['dec'] = dec0 + (s['target_dec'] - dec0) * progress
+        now = time.time()
+        # jogs move at 0.1 degrees per (accelerated) second
+        step = (now - s['moved_at']) * self.speed * 0.1
+        s['moved_at'] = now
+        for direction in s['moving']:
+            if direction == 'n':
+                s['dec'] = min(90.0, s['dec'] + step)
+            elif direction == 's':
+                s['dec'] = max(-90.0, s['dec'] - step)
+            elif direction == 'e':
+                s['ra'] = (s['ra'] - step / 15.0) % 24.0
+            elif direction == 'w':
+                s['ra'] = (s['ra'] + step / 15.0) % 24.0
+        return s['ra'] % 24.0, s['dec']
+
+    def _lst(self):
+        return (6.0 + (time.time() - self.state['lst0']) * SIDEREAL / 3600.0) % 24.0
+
+    def handle(self, command):
+        s = self.state
+        opcode, args = split_command(command)
+        if opcode == 'ACK':
+            return s['mount']
+        if opcode in ('GR', 'Gr'):
+            text = _hms(self._position()[0] if opcode == 'GR' else s['target_ra'])
+            # low precision is HH:MM.T
+            return text if s['high'] else '{}.{:d}#'.format(text[:5], int(text[6:8]) // 6)
+        if opcode in ('GD', 'Gd'):
+            return _dms(self._position()[1] if opcode == 'GD' else s['target_dec'])
+        if opcode == 'GA':
+            return _dms(max(-90.0, min(90.0, 90.0 - abs(self._position()[1] - s['lat']))))
+        if opcode == 'GZ':
+            return _dms((self._position()[0] * 15.0) % 360.0, 3, False)
+        if opcode == 'GS':
+            return _hms(self._lst())
+        if opcode in ('GL', 'Ga'):
+            t = time.localtime()
+            return '{:02d}:{:02d}:{:02d}#'.format(t.tm_hour, t.tm_min, t.tm_sec)
+        if opcode == 'GC':
+            return time.strftime('%m/%d/%y#')
+        if opcode == 'GG':
+            return '{:+05.1f}#'.format(s['utc'])
+        if opcode == 'Gt':
+            return _dms(s['lat'])[:-4] + '#'
+        if opcode == 'Gg':
+            return _dms(s['long'], 3, False)[:-4] + '#'
+        if opcode == 'GT':
+            return '{:04.1f}#'.format(s['rate'])
+        if opcode in ('Gb', 'Gf'):
+            return '{:+05.1f}#'.format(s['bright'] if opcode == 'Gb' else s['faint'])
+        if opcode in ('Gl', 'Gs'):
+            return '{:03d}\'#'.format(s['size_min'] if opcode == 'Gl' else s['size_max'])
+        if opcode == 'GF':
+            return '{:03d}#'.format(s['field'])
+        if opcode == 'Gq':
+            return s['quality'] + '#'
+        if opcode == 'Gy':
+            return s['classes'] + '#'
+        if opcode in ('Gh', 'Go'):
+            return '{:+03d}*#'.format(10 if opcode == 'Gh' else 85)
+        if opcode in ('GVP', 'GVN', 'GVD', 'GVT', 'GM', 'GN', 'GO', 'GP'):
+            return {'GVP': 'Autostar#', 'GVN': '43Eg#', 'GVD': 'Jan 01 2005#', 'GVT': '12:00:00#'}.get(opcode, 'Site#')
+        if opcode == 'fT':
+            return '{:+07.3f}#'.format(s['temp'])
+        if opcode == 'D':
+            self._position()
+            return '\x7f#' if s['slew_from'] is not None else '#'
+        if opcode == 'Sr':
+            s['target_ra'] = _hms_value(args)
+            return '1'
+        if opcode == 'Sd':
+            s['target_dec'] = _dms_value(args)
+            return '1'
+        if opcode == 'Sb':
+            s['bright'] = float(args)
+            return '1'
+        if opcode == 'Sf':
+            s['faint'] = float(args)
+            return '1'
+        if opcode in ('Sl', 'Ss'):
+            s['size_min' if opcode == 'Sl' else 'size_max'] = int(args)
+            return '1'
+        if opcode == 'SF':
+            s['field'] = int(args)
+            return '1'
+        if opcode == 'Sy':
+            s['classes'] = args
+            return '1'
+        if opcode == 'MS':
+            s['slew_from'] = self._position()
+            s['slew_start'] = time.time()
+            return '0'
+        if opcode in ('Me', 'Mn', 'Ms', 'Mw'):
+            self._position()
+            s['moving'].add(opcode[1])
+            return ''
+        if opcode in ('Q', 'Qe', 'Qn', 'Qs', 'Qw'):
+            self._position()
+            if opcode == 'Q':
+                s['moving'].clear()
+                s['slew_from'] = None
+            else:
+                s['moving'].discard(opcode[1])
+            return ''
+        if opcode in ('F+', 'F-'):
+            s['focus'] += 1 if opcode == 'F-' else -1
+            return ''
+        if opcode in ('AA', 'AL', 'AP'):
+            s['mount'] = opcode[1]
+            return ''
+        if opcode == 'W':
+            s['site'] = int(args)
+            return ''
+        if opcode in ('TQ', 'TL', 'TM'):
+            s['tracking'] = opcode
+            return ''
+        if opcode == 'ST':
+            s['rate'] = float(args)
+            return '1'
+        if opcode == 'U':
+            s['high'] = not s['high']
+            return ''
+        if opcode == 'P':
+            s['pointing'] = not s['pointing']
+            return 'HIGH PRECISION#' if s['pointing'] else 'LOW PRECISION#'
+        if opcode in ('Sa', 'SE', 'Se', 'Sg', 'SG', 'Sh', 'SL', 'SM', 'SN', 'SO', 'SP', 'So', 'SS',
+                      'St', 'Sw', 'Sz', 'T', 'SB'):
+            return '1'
+        if opcode in ('MA', 'Aa', 'gT'):
+            return '0'
+        if opcode == 'SC':
+            return '1Updating Planetary Data#                #'
+        if opcode == 'h?':
+            return '1'
+        if opcode in ('CM', 'CL'):
+            return ' M31 EX GAL MAG 3.5 SZ178.0\'#'
+        if opcode in ('??', '?+', '?-', 'G0', 'G1', 'G2', 'gps', 'Gc'):
+            return {'Gc': '24#'}.get(opcode, '#')
+        return ''
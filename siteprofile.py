@@ -0,0 +1,179 @@
+import json
+import math
+import os
+
+import telemetry
+
+
+# Declarative site/configuration profiles
+# A profile is a plain dict (usually loaded from JSON) such as
+#   {"site": 1, "site_name": "Backyard", "latitude": 39.17, "east_longitude": -86.53,
+#    "utc_offset": 4.0, "elev_limit_min": 10, "faint_limit": 12.0, "object_classes": "GPDCO"}
+# apply() reads the current handset values with one pipelined batch of G-queries,
+# writes only the settings that differ and returns the diff, so re-applying the
+# same profile costs a single batch read.
+
+
+def _number(text):
+    return float(text.strip().rstrip('#').rstrip("*'’\xdf"))
+
+def _text(text):
+    return text.strip().rstrip('#').strip()
+
+def _quality(text):
+    return _text(text).upper()
+
+def _longitude(text):
+    # :Gg# is West positive (East negative) and may come back as 0..360
+    return -telemetry.parse_dms(text)
+
+def _split_degrees(value):
+    # signed degrees -> (signed dd, mm) rounded to the arcminute
+    minutes = int(round(abs(value) * 60.0))
+    return math.copysign(minutes // 60, value), minutes % 60
+
+def _same_angle(a, b, modulus):
+    return abs((a - b + modulus / 2) % modulus - modulus / 2) < 1.0 / 60.0 - 1e-9
+
+# handset :Sq# cycle order
+QUALITY_CYCLE = ['VP', 'PR', 'FR', 'GD', 'VG', 'EX', 'SU']
+
+
+def _set_latitude(scope, value):
+    return scope.set_site_lat(*_split_degrees(value))
+
+def _set_longitude(scope, value):
+    ddd, mm = _split_degrees((-value) % 360.0)
+    return scope.set_site_long(int(ddd), mm)
+
+def _set_quality(scope, value):
+    current = _quality(scope.get_quality_min())
+    steps = (QUALITY_CYCLE.index(value) - QUALITY_CYCLE.index(current)) % len(QUALITY_CYCLE)
+    for _ in range(steps):
+        scope.cycle_quality_limit()
+    return steps
+
+
+# name -> (query, parse, compare, apply)
+SETTINGS = {
+    'latitude': (':Gt#', telemetry.parse_dms, lambda a, b: _same_angle(a, b, 360.0), _set_latitude),
+    'east_longitude': (':Gg#', _longitude, lambda a, b: _same_angle(a, b, 360.0), _set_longitude),
+    'utc_offset': (':GG#', _number, lambda a, b: abs(a - b) < 0.05, lambda s, v: s.set_utc_offset(v)),
+    'elev_limit_min': (':Gh#', _number, lambda a, b: int(a) == int(b), lambda s, v: s.set_elev_limit_min(int(v))),
+    'elev_limit_max': (':Go#', _number, lambda a, b: int(a) == int(b), lambda s, v: s.set_elev_limit_max(int(v))),
+    'bright_limit': (':Gb#', _number, lambda a, b: abs(a - b) < 0.05, lambda s, v: s.set_bright_limit(v)),
+    'faint_limit': (':Gf#', _number, lambda a, b: abs(a - b) < 0.05, lambda s, v: s.set_faint_mag_limit(v)),
+    'size_limit_min': (':Gl#', _number, lambda a, b: int(a) == int(b), lambda s, v: s.set_size_limit_min(int(v))),
+    'size_limit_max': (':Gs#', _number, lambda a, b: int(a) == int(b), lambda s, v: s.set_size_limit_max(int(v))),
+    'field_diameter': (':GF#', _number, lambda a, b: int(a) == int(b), lambda s, v: s.set_id_field_diam(int(v))),
+    'quality': (':Gq#', _quality, lambda a, b: a == b, _set_quality),
+    'object_classes': (':Gy#', _text, lambda a, b: a == b, lambda s, v: s.set_obj_sel_string(v)),
+    'tracking_rate': (':GT#', _number, lambda a, b: abs(a - b) < 0.05, lambda s, v: s.set_tracking_rate(v)),
+}
+
+SITE_NAME_QUERIES = {1: ':GM#', 2: ':GN#', 3: ':GO#', 4: ':GP#'}
+
+# Settings the handset cannot report. They are compared against the values last written
+# by apply(), which are kept in a state file (STATE_PATH unless told otherwise) so they
+# survive a service restart.
+STATE_PATH = os.path.join('~', '.cache', 'honeypi', 'profile-state.json')
+
+WRITE_ONLY = {
+    'max_slew_rate': lambda s, v: s.set_max_slew_rate(int(v)),
+    'guide_rate': lambda s, v: s.set_guide_rate(v),
+    'reticule_flash_rate': lambda s, v: s.set_reticule_flash_rate(int(v)),
+    'reticule_duty_cycle': lambda s, v: s.set_reticule_flash_cycle(int(v)),
+}
+
+
+class Profile(dict):
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self, f, indent=2, sort_keys=True)
+
+    def check(self):
+        known = set(SETTINGS) | set(WRITE_ONLY) | set(['site', 'site_name'])
+        unknown = sorted(set(self) - known)
+        assert not unknown, 'unknown profile settings: {}'.format(', '.join(unknown))
+        if 'site_name' in self:
+            assert self.get('site') in SITE_NAME_QUERIES, 'site_name needs a site number 1..4'
+
+    def read(self, scope):
+        # Current handset values for every queryable setting in this profile, in one batch
+        names = [name for name in sorted(self) if name in SETTINGS]
+        queries = [SETTINGS[name][0] for name in names]
+        if 'site_name' in self:
+            names.append('site_name')
+            queries.append(SITE_NAME_QUERIES[self['site']])
+        replies = scope.query_batch(queries)
+        current = {}
+        for name, reply in zip(names, replies):
+            parse = _text if name == 'site_name' else SETTINGS[name][1]
+            try:
+                current[name] = parse(reply)
+            except (ValueError, IndexError):
+                current[name] = None
+        return current
+
+    def diff(self, scope, state=None):
+        # [(name, current, wanted)] for every setting that needs writing
+        self.check()
+        state = state or {}
+        changes = []
+        if 'site' in self and state.get('site') != self['site']:
+            changes.append(('site', state.get('site'), self['site']))
+        current = self.read(scope)
+        for name in sorted(current):
+            value, wanted = current[name], self[name]
+            if name == 'site_name':
+                same = value == wanted[:15]
+            else:
+                same = value is not None and SETTINGS[name][2](value, wanted)
+            if not same:
+                changes.append((name, value, wanted))
+        for name in sorted(set(self) & set(WRITE_ONLY)):
+            if state.get(name) != self[name]:
+                changes.append((name, state.get(name), self[name]))
+        return changes
+
+    def apply(self, scope, state_path=STATE_PATH, dry_run=False):
+        # Write only what differs; returns the diff that was (or, with dry_run, would be) applied.
+        # state_path=None forgets what was written, so the site and write-only settings are
+        # sent (and reported) every time.
+        state = {}
+        if state_path:
+            state_path = os.path.expanduser(state_path)
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+        with scope.lock:
+            if dry_run:
+                return self.diff(scope, state)
+            site_changes = []
+            if 'site' in self and state.get('site') != self['site']:
+                # select first, so the queries below read the profile's site
+                scope.site_select(self['site'] - 1)
+                site_changes.append(('site', state.get('site'), self['site']))
+                state['site'] = self['site']
+            changes = site_changes + self.diff(scope, state)
+            for name, _, wanted in changes[len(site_changes):]:
+                if name == 'site_name':
+                    scope.set_site_name(self['site'], wanted)
+                elif name in WRITE_ONLY:
+                    WRITE_ONLY[name](scope, wanted)
+                    state[name] = wanted
+                else:
+                    SETTINGS[name][3](scope, wanted)
+        if state_path:
+            directory = os.path.dirname(state_path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(state_path, 'w') as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+        return changes
+    # Profile site numbers are 1..4 as in :SM#../:SP#; site_select() takes 0..3.
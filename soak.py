@@ -0,0 +1,277 @@
+import argparse
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+import catalog
+import framing
+import jog
+import mosaic
+import telemetry
+import thermal
+from control import Autostar
+from simulator import SimulatedPort
+
+
+# Soak / concurrency stress harness
+# Drives one Autostar (behind framing.FramedPort) against simulator.SimulatedPort from
+# several threads at once — telemetry polling, gotos, jogs, focuser moves and setters —
+# with latency spikes and dropped bytes injected by the simulator. `speed` accelerates
+# worker pacing and slews, so an hour at --speed 10 stands in for ten hours of use.
+# Every `window` seconds a row of metrics is recorded: worker operations per second,
+# p50/p99 reply latency (time spent in readline, measured above the framing layer so
+# recovery counts against it), resident memory, and desync / timeout / failed counts
+# per 1000 commands.
+# The run fails as soon as a row breaks one of the BUDGETS, or when a worker has not
+# finished an operation for `stall` seconds (the wedge this harness exists to catch).
+#     python soak.py --duration 3600 --speed 10 --csv soak.csv
+
+BUDGETS = {
+    'min_throughput': 0.3,      # worker operations per simulated second, all workers together
+    'max_p99': 2.0,             # seconds
+    'max_p50_drift': 3.0,       # p50 latency relative to the first window
+    'max_memory_growth': 32.0,  # MB of resident memory since the first window
+    'max_desyncs': 20.0,        # per 1000 commands
+    'max_timeouts': 20.0,       # per 1000 commands
+    'max_failed': 5.0,          # per 1000 commands; retried queries that still came back wrong
+    'max_errors': 20.0,         # per 1000 commands; replies that got past framing but did not parse
+}
+
+COLUMNS = ('t', 'ops', 'throughput', 'p50', 'p99', 'errors', 'memory',
+           'commands', 'desyncs', 'timeouts', 'failed', 'spikes', 'drops')
+
+
+def resident_memory():
+    # current RSS in MB (peak RSS where /proc is not available)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576.0
+    except (IOError, OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class LatencyPort(object):
+    def __init__(self, port, record):
+        self.port = port
+        self.record = record
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def readline(self):
+        start = time.time()
+        reply = self.port.readline()
+        self.record(time.time() - start)
+        return reply
+
+
+class Soak(object):
+    def __init__(self, duration=600.0, speed=10.0, window=10.0, stall=30.0, budgets=None,
+                 latency=0.002, spike_rate=0.002, spike=1.5, drop_rate=0.002, seed=None, out=sys.stdout):
+        self.duration = duration
+        self.speed = speed
+        self.window = window
+        self.stall = stall
+        self.budgets = dict(BUDGETS, **(budgets or {}))
+        self.out = out
+        self.random = random.Random(seed)
+        self.sim = SimulatedPort(latency=latency, spike_rate=spike_rate, spike=spike,
+                                 drop_rate=drop_rate, speed=speed, timeout=1.0, seed=seed)
+        self.port = framing.FramedPort(self.sim)
+        self.scope = Autostar(port=LatencyPort(self.port, self.record))
+        self.stopped = threading.Event()
+        self.samples_lock = threading.Lock()
+        self.latencies = []
+        self.ops = 0
+        self.errors = 0
+        self.last_done = {}
+        self.rows = []
+        self.failures = []
+
+    def pace(self, seconds):
+        # sleep `seconds` of simulated time; True once the run is over
+        return self.stopped.wait(seconds / self.speed)
+
+    def record(self, latency):
+        with self.samples_lock:
+            self.latencies.append(latency)
+
+    def step(self, operation, *args):
+        try:
+            operation(*args)
+        except (ValueError, IndexError, AssertionError):
+            # a garbled or missing reply that got past framing
+            with self.samples_lock:
+                self.errors += 1
+        with self.samples_lock:
+            self.ops += 1
+            self.last_done[threading.current_thread().name] = time.time()
+
+    # workers
+    def poll_telemetry(self):
+        def sample():
+            with self.scope.lock:
+                telemetry.sample_position(self.scope)
+                telemetry.sample_status(self.scope)
+        while not self.pace(1.0):
+            self.step(sample)
+
+    def goto(self):
+        def slew():
+            ra, dec = self.random.uniform(0.0, 24.0), self.random.uniform(-30.0, 80.0)
+            with self.scope.lock:
+                catalog.set_target_coords(self.scope, ra, dec)
+                self.scope.slew_to_obj()
+            mosaic.wait_for_slew(self.scope, poll=0.5 / self.speed, timeout=120.0 / self.speed)
+        while not self.pace(30.0):
+            self.step(slew)
+
+    def jog(self):
+        control = jog.ManualControl(self.scope, window=0.05)
+        control.start()
+        def nudge():
+            direction = self.random.choice(sorted(jog.AXES))
+            control.set_rate(self.random.choice(sorted(jog.RATES)))
+            control.press(direction)
+            self.pace(self.random.uniform(0.5, 3.0))
+            control.release(direction)
+        try:
+            while not self.pace(5.0):
+                self.step(nudge)
+        finally:
+            control.close()
+            control.join(5.0)
+
+    def focus(self):
+        focuser = thermal.ThermalFocus(self.scope, coefficient=0.0)
+        while not self.pace(20.0):
+            delta = self.random.choice((-1, 1)) * self.random.uniform(20.0, 200.0)
+            self.step(focuser.move, delta / self.speed)
+
+    def setters(self):
+        def push():
+            with self.scope.lock:
+                self.scope.set_bright_limit(self.random.uniform(-5.0, 5.0))
+                self.scope.set_faint_mag_limit(self.random.uniform(8.0, 16.0))
+                self.scope.set_size_limit_min(self.random.randint(0, 10))
+                self.scope.set_size_limit_max(self.random.randint(100, 999))
+                self.scope.set_id_field_diam(self.random.randint(5, 60))
+        while not self.pace(10.0):
+            self.step(push)
+
+    # monitoring
+    def sample(self, start, previous):
+        with self.samples_lock:
+            latencies, self.latencies = self.latencies, []
+            ops, self.ops = self.ops, 0
+            errors, self.errors = self.errors, 0
+        counters = dict(self.port.counters)
+        counters.update(self.sim.counters)
+        row = {
+            't': time.time() - start,
+            'ops': ops,
+            'throughput': ops / self.window,
+            'p50': _percentile(latencies, 0.5),
+            'p99': _percentile(latencies, 0.99),
+            'errors': errors,
+            'memory': resident_memory(),
+        }
+        for name in ('commands', 'desyncs', 'timeouts', 'failed', 'spikes', 'drops'):
+            row[name] = counters.get(name, 0) - previous.get(name, 0)
+        return row, counters
+
+    def check(self, row):
+        budgets = self.budgets
+        first = self.rows[0]
+        per_k = 1000.0 / max(1, row['commands'])
+        problems = []
+        if row['throughput'] / self.speed < budgets['min_throughput']:
+            problems.append('throughput {:.1f}/s'.format(row['throughput']))
+        if row['p99'] > budgets['max_p99']:
+            problems.append('p99 latency {:.3f}s'.format(row['p99']))
+        if first['p50'] > 0 and row['p50'] > budgets['max_p50_drift'] * first['p50']:
+            problems.append('p50 latency drifted {:.1f}x'.format(row['p50'] / first['p50']))
+        if row['memory'] - first['memory'] > budgets['max_memory_growth']:
+            problems.append('memory grew {:.1f} MB'.format(row['memory'] - first['memory']))
+        for name in ('desyncs', 'timeouts', 'failed', 'errors'):
+            if row[name] * per_k > budgets['max_' + name]:
+                problems.append('{} {:.1f}/1000 commands'.format(name, row[name] * per_k))
+        now = time.time()
+        with self.samples_lock:
+            last_done = dict(self.last_done)
+        for name, done in sorted(last_done.items()):
+            if now - done > self.stall:
+                problems.append('{} stalled for {:.0f}s'.format(name, now - done))
+        return problems
+
+    def report(self, row):
+        self.out.write(' '.join('{}={:.3f}'.format(k, row[k]) if isinstance(row[k], float)
+                                else '{}={}'.format(k, row[k]) for k in COLUMNS) + '\n')
+        self.out.flush()
+
+    def run(self):
+        workers = [threading.Thread(target=w, name=w.__name__)
+                   for w in (self.poll_telemetry, self.goto, self.jog, self.focus, self.setters)]
+        start = time.time()
+        for worker in workers:
+            self.last_done[worker.name] = start
+            worker.daemon = True
+            worker.start()
+        previous = {}
+        try:
+            while time.time() - start < self.duration:
+                if self.stopped.wait(self.window):
+                    break
+                row, previous = self.sample(start, previous)
+                self.rows.append(row)
+                self.report(row)
+                problems = self.check(row)
+                if problems:
+                    self.failures.append((row['t'], problems))
+                    self.out.write('FAIL at {:.0f}s: {}\n'.format(row['t'], '; '.join(problems)))
+                    break
+        finally:
+            self.stopped.set()
+            for worker in workers:
+                worker.join(self.stall)
+        if not self.failures:
+            self.out.write('PASS: {} windows, {} commands\n'.format(len(self.rows), self.sim.counters['commands']))
+        return not self.failures
+
+    def export_csv(self, path):
+        with open(path, 'w') as f:
+            f.write(','.join(COLUMNS) + '\n')
+            for row in self.rows:
+                f.write(','.join(str(row[k]) for k in COLUMNS) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Soak-test Autostar against a simulated handset.')
+    parser.add_argument('--duration', type=float, default=600.0, help='wall-clock seconds')
+    parser.add_argument('--speed', type=float, default=10.0, help='simulated seconds per second')
+    parser.add_argument('--window', type=float, default=10.0, help='seconds per metrics row')
+    parser.add_argument('--stall', type=float, default=30.0, help='seconds without progress that count as a wedge')
+    parser.add_argument('--spike-rate', type=float, default=0.002)
+    parser.add_argument('--drop-rate', type=float, default=0.002)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--csv', help='write the metrics rows here')
+    options = parser.parse_args(argv)
+    soak = Soak(duration=options.duration, speed=options.speed, window=options.window, stall=options.stall,
+                spike_rate=options.spike_rate, drop_rate=options.drop_rate, seed=options.seed)
+    passed = soak.run()
+    if options.csv:
+        soak.export_csv(options.csv)
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
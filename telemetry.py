@@ -0,0 +1,185 @@
+import array
+import bisect
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Reply parsing
+# The handset answers position queries with '#' terminated sexagesimal strings
+# whose layout depends on the precision setting, e.g. HH:MM.T# / HH:MM:SS# for RA
+# and sDD*MM# / sDD*MM'SS# for Dec, Alt and Az. The degree sign is sent as '*' in
+# the manual but as 0xDF by most handsets.
+
+def _fields(text):
+    text = text.strip().rstrip('#')
+    for sep in ('*', '\xdf', '’', "'", ':'):
+        text = text.replace(sep, ' ')
+    return text.split()
+
+def parse_ra(text):
+    # HH:MM.T or HH:MM:SS -> decimal hours
+    parts = _fields(text)
+    hours = float(parts[0]) + float(parts[1]) / 60.0
+    if len(parts) > 2:
+        hours += float(parts[2]) / 3600.0
+    return hours
+
+def parse_dms(text):
+    # sDD*MM, sDD*MM'SS or DDD*MM -> decimal degrees
+    text = text.strip()
+    sign = -1.0 if text.startswith('-') else 1.0
+    parts = _fields(text.lstrip('+-'))
+    degrees = float(parts[0]) + float(parts[1]) / 60.0
+    if len(parts) > 2:
+        degrees += float(parts[2]) / 3600.0
+    return sign * degrees
+
+def parse_hms(text):
+    # HH:MM:SS -> seconds since midnight
+    parts = _fields(text)
+    return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
+
+def parse_float(text):
+    # sdd.ddd# / TT.T# -> float
+    return float(text.strip().rstrip('#'))
+
+
+# Sample types
+# One slotted object per reading instead of a dict of raw reply strings.
+
+class PositionSample(object):
+    __slots__ = ('t', 'ra', 'dec', 'alt', 'az')
+    fields = __slots__
+
+    def __init__(self, t, ra, dec, alt, az):
+        self.t = t
+        self.ra = ra
+        self.dec = dec
+        self.alt = alt
+        self.az = az
+
+    def __iter__(self):
+        return iter((self.t, self.ra, self.dec, self.alt, self.az))
+
+    def __repr__(self):
+        return 'PositionSample(t={:.3f}, ra={:.5f}, dec={:.4f}, alt={:.4f}, az={:.4f})'.format(*self)
+    # t in seconds (time.time()), ra in hours, dec/alt/az in degrees
+
+
+class StatusSample(object):
+    __slots__ = ('t', 'lst', 'tracking_rate', 'tube_temp')
+    fields = __slots__
+
+    def __init__(self, t, lst, tracking_rate, tube_temp):
+        self.t = t
+        self.lst = lst
+        self.tracking_rate = tracking_rate
+        self.tube_temp = tube_temp
+
+    def __iter__(self):
+        return iter((self.t, self.lst, self.tracking_rate, self.tube_temp))
+
+    def __repr__(self):
+        return 'StatusSample(t={:.3f}, lst={:.0f}, tracking_rate={:.1f}, tube_temp={:.2f})'.format(*self)
+    # lst in seconds since sidereal midnight, tracking_rate in Hz, tube_temp in Celsius (nan if unsupported)
+
+
+def sample_position(scope):
+    return PositionSample(time.time(),
+                          parse_ra(scope.get_tel_ra()),
+                          parse_dms(scope.get_telescope_dec()),
+                          parse_dms(scope.get_tel_alt()),
+                          parse_dms(scope.get_tel_az()))
+
+def sample_status(scope):
+    try:
+        tube_temp = parse_float(scope.get_tube_temp())
+    except ValueError:
+        tube_temp = float('nan')
+    return StatusSample(time.time(),
+                        parse_hms(scope.get_lst()),
+                        parse_float(scope.get_tracking_rate()),
+                        tube_temp)
+
+
+# Columnar storage
+# Each field lives in its own array.array('d'), so a night of samples costs
+# 8 bytes per field instead of a dict and several str objects per reading.
+
+class TelemetrySeries(object):
+    def __init__(self, sample_type=PositionSample):
+        self.sample_type = sample_type
+        self.columns = [array.array('d') for _ in sample_type.fields]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            out = TelemetrySeries(self.sample_type)
+            out.columns = [col[index] for col in self.columns]
+            return out
+        return self.sample_type(*[col[index] for col in self.columns])
+
+    def __iter__(self):
+        for row in zip(*self.columns):
+            yield self.sample_type(*row)
+
+    def column(self, name):
+        return self.columns[self.sample_type.fields.index(name)]
+
+    def append(self, sample):
+        for col, value in zip(self.columns, sample):
+            col.append(value)
+
+    def extend(self, samples):
+        for sample in samples:
+            self.append(sample)
+
+    def window(self, t0, t1):
+        # samples with t0 <= t < t1; assumes samples were appended in time order
+        times = self.columns[0]
+        return self[bisect.bisect_left(times, t0):bisect.bisect_left(times, t1)]
+
+    def downsample(self, interval):
+        # mean of each field over consecutive buckets of `interval` seconds
+        # (plain means, so buckets straddling RA 0h/24h are not unwrapped)
+        out = TelemetrySeries(self.sample_type)
+        n = len(self)
+        if not n:
+            return out
+        times = self.columns[0]
+        start = 0
+        while start < n:
+            edge = times[start] - (times[start] % interval) + interval
+            stop = bisect.bisect_left(times, edge, start)
+            count = float(stop - start)
+            for src, dst in zip(self.columns, out.columns):
+                dst.append(sum(src[start:stop]) / count)
+            start = stop
+        return out
+
+    def nbytes(self):
+        return sum(col.itemsize * len(col) for col in self.columns)
+
+    def to_numpy(self, copy=True):
+        # numpy arrays of the columns, keyed by field name. copy=False returns zero-copy views,
+        # but while any of them is alive append() raises BufferError (the series is frozen).
+        if np is None:
+            raise ImportError('numpy is required for TelemetrySeries.to_numpy')
+        return dict((name, np.array(col, dtype=np.float64) if copy else np.frombuffer(col, dtype=np.float64))
+                    for name, col in zip(self.sample_type.fields, self.columns))
+
+    def export_csv(self, fileobj):
+        fileobj.write(','.join(self.sample_type.fields) + '\n')
+        for row in zip(*self.columns):
+            fileobj.write(','.join(repr(v) for v in row) + '\n')
+
+    def export_binary(self, fileobj):
+        # column-major raw doubles, readable with numpy.fromfile(...).reshape(nfields, -1)
+        for col in self.columns:
+            col.tofile(fileobj)
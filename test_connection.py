@@ -0,0 +1,54 @@
+import time
+
+import connection
+import framing
+from control import Autostar
+from simulator import SimulatedPort
+
+
+# connection.ManagedPort against simulator.SimulatedPort: a handset that is power-cycled
+# between two commands has to come back with the state it was given before.
+#     python -m pytest -q test_connection.py
+
+def _scope():
+    sim = SimulatedPort(latency=0.001, timeout=1.0, seed=1)
+    port = connection.ManagedPort(lambda rate: framing.FramedPort(sim), backoff=0.1, give_up=10.0)
+    scope = Autostar(port)
+    scope.align_polar()
+    scope.tracking_lunar()
+    scope.toggle_precision()
+    assert scope.get_tel_ra().count(':') == 1
+    return sim, port, scope
+
+def _check_restored(sim, port, scope, downtime):
+    sim.power_cycle(downtime)
+    start = time.time()
+    reply = scope.get_tel_ra()
+    assert time.time() - start < downtime + 3.0
+    # answered in the precision it was left in, by a handset that was put back as it was
+    assert reply.count(':') == 1 and reply.endswith('#')
+    assert sim.state['mount'] == 'P'
+    assert sim.state['tracking'] == 'TL'
+    assert sim.state['high'] is False
+    assert port.counters['restores'] >= 2
+
+def test_short_power_cycle():
+    sim, port, scope = _scope()
+    _check_restored(sim, port, scope, 0.5)
+
+def test_power_cycle():
+    sim, port, scope = _scope()
+    _check_restored(sim, port, scope, 1.0)
+
+def test_power_cycle_between_commands():
+    # back before the next command is sent: only the replies can tell
+    sim, port, scope = _scope()
+    _check_restored(sim, port, scope, 0.0)
+
+def test_state_changes_are_not_resets():
+    sim, port, scope = _scope()
+    scope.align_altaz()
+    scope.toggle_precision()
+    assert scope.get_tel_ra().count(':') == 2
+    assert scope.alignment_query() == 'A'
+    assert port.counters['resets'] == 0
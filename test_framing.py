@@ -0,0 +1,46 @@
+import threading
+
+import framing
+from control import Autostar
+from simulator import SimulatedPort
+
+
+# framing.FramedPort against simulator.SimulatedPort
+#     python -m pytest -q test_framing.py
+
+def _scope(slow_reply):
+    # `slow_reply` stands in for the handset's answer to :Aa# / :gT#, None for none at all
+    sim = SimulatedPort(latency=0.001, timeout=0.3, seed=1)
+    handle = sim.handle
+    def answer(command):
+        if command in (':Aa#', ':gT#'):
+            return slow_reply
+        return handle(command)
+    sim.handle = answer
+    port = framing.FramedPort(sim)
+    return sim, port, Autostar(port)
+
+def test_unanswered_slow_command_does_not_desync():
+    sim, port, scope = _scope(None)
+    assert scope.align_auto() == ''
+    for _ in range(3):
+        assert scope.get_tel_ra() == '05:30:00#'
+        assert scope.get_telescope_dec().startswith('+20')
+    assert port.counters['timeouts'] == 1
+    assert not port.pending
+
+def test_slow_reply_while_polling():
+    sim, port, scope = _scope(None)
+    # the reply turns up on the third readline() of gps_update_time's loop
+    def late():
+        with sim.condition:
+            sim._schedule('1')
+    threading.Timer(0.7, late).start()
+    assert scope.gps_update_time(timeout=5) == '1'
+    assert scope.get_tel_ra() == '05:30:00#'
+    assert port.counters['timeouts'] == 0
+
+def test_slow_reply_in_time():
+    sim, port, scope = _scope('1')
+    assert scope.align_auto() == '1'
+    assert scope.get_tel_ra() == '05:30:00#'
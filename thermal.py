@@ -0,0 +1,133 @@
+import math
+import threading
+import time
+
+import telemetry
+
+
+# Thermal focus compensation
+# Focus drifts with tube temperature. ThermalFocus smooths the :fT# reading and keeps
+# the focuser at position = reference + coefficient * (temperature - reference temperature),
+# where positions are in milliseconds of focuser travel at a fixed speed (positive is
+# outward, :F-#) since the Autostar focuser can only be driven by timed moves.
+# Moves are made only once the wanted correction exceeds `min_move`, which together with
+# the smoothing gives the hysteresis that stops the focuser hunting on sensor noise.
+
+def query_temperature(scope):
+    with scope.lock:
+        return telemetry.parse_float(scope.get_tube_temp())
+
+def shared_temperature(reader):
+    # Read the tube temperature published by sharedstate.TelemetryPump instead of the port
+    def source(scope):
+        return reader.snapshot().tube_temp
+    return source
+
+
+def calibrate(pairs):
+    # Least-squares line through (temperature, best focus position) pairs.
+    # Returns (coefficient ms/degC, intercept ms, rms ms).
+    n = len(pairs)
+    assert n >= 2, 'need at least two (temperature, position) pairs'
+    mean_t = sum(t for t, _ in pairs) / n
+    mean_p = sum(p for _, p in pairs) / n
+    var_t = sum((t - mean_t) ** 2 for t, _ in pairs)
+    assert var_t > 0, 'pairs need more than one temperature'
+    coefficient = sum((t - mean_t) * (p - mean_p) for t, p in pairs) / var_t
+    intercept = mean_p - coefficient * mean_t
+    rms = math.sqrt(sum((p - intercept - coefficient * t) ** 2 for t, p in pairs) / n)
+    return coefficient, intercept, rms
+
+
+class ThermalFocus(threading.Thread):
+    def __init__(self, scope, coefficient, interval=60.0, time_constant=600.0, min_move=50.0,
+                 backlash=0.0, speed=1, source=query_temperature):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scope = scope
+        self.coefficient = coefficient
+        self.interval = interval
+        self.time_constant = time_constant
+        self.min_move = min_move
+        self.backlash = backlash
+        self.speed = speed
+        self.source = source
+        self.stopped = threading.Event()
+        self.smoothed = None
+        self.last_sample = None
+        self.reference = None
+        self.position = 0.0
+        self.direction = 0
+        self.log = []
+
+    def sample(self):
+        # exponential smoothing with a time constant, robust to irregular sample spacing
+        value = self.source(self.scope)
+        now = time.time()
+        if value is None or value != value:
+            return self.smoothed
+        if self.smoothed is None:
+            self.smoothed = value
+        else:
+            alpha = 1.0 - math.exp(-(now - self.last_sample) / self.time_constant)
+            self.smoothed += alpha * (value - self.smoothed)
+        self.last_sample = now
+        return self.smoothed
+
+    def set_reference(self, position=None):
+        # Call after focusing by hand: the current smoothed temperature and `position`
+        # (default: where we think the focuser is) become the model's anchor, and the pair
+        # is kept in self.log for calibrate().
+        temperature = self.sample()
+        if position is not None:
+            self.position = position
+        self.reference = (temperature, self.position)
+        self.log.append((temperature, self.position))
+
+    def move(self, delta):
+        # timed focuser move of `delta` ms (positive outward), with backlash on reversal
+        direction = 1 if delta > 0 else -1
+        duration = abs(delta)
+        if self.direction and direction != self.direction:
+            duration += self.backlash
+        try:
+            with self.scope.lock:
+                self.scope.set_focus_speed(self.speed)
+                if direction > 0:
+                    self.scope.focus_out()
+                else:
+                    self.scope.focus_in()
+            time.sleep(duration / 1000.0)
+        finally:
+            # also after a port error, so the focuser is never left running
+            with self.scope.lock:
+                self.scope.focus_stop()
+        self.position += delta
+        self.direction = direction
+
+    def step(self):
+        temperature = self.sample()
+        if temperature is None:
+            return 0.0
+        if self.reference is None:
+            self.set_reference()
+            return 0.0
+        ref_temperature, ref_position = self.reference
+        wanted = ref_position + self.coefficient * (temperature - ref_temperature)
+        delta = wanted - self.position
+        if abs(delta) < self.min_move:
+            return 0.0
+        self.move(delta)
+        return delta
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.step()
+            except (ValueError, IndexError, IOError, OSError):
+                # bad reading or port outage: try again next interval
+                pass
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
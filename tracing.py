@@ -0,0 +1,137 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import framing
+from control import split_command
+
+
+# Command tracing
+# enable() swaps the Autostar port and lock for traced wrappers and disable() puts
+# the originals back, so an untraced Autostar runs exactly the original code path.
+# Every command produces Chrome trace-event spans on its thread's track:
+#   enqueue  waiting for the port lock (only when it was contended)
+#   write    port.write()
+#   wait     end of write until the first reply byte (handset think time)
+#   receive  first reply byte until the frame is complete
+# Over a raw transport the first byte is read here; over framing.FramedPort (or anything
+# wrapping it, such as connection.ManagedPort) the wrapped readline() is timed as a whole
+# and the first-byte time comes from the framing layer, so its reply accounting stays intact.
+#   command  write start until the frame is complete, tagged with opcode and args
+# export_chrome() writes JSON that chrome://tracing and ui.perfetto.dev open directly.
+
+
+class Tracer(object):
+    def __init__(self, max_events=100000):
+        self.events = collections.deque(maxlen=max_events)
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+
+    def span(self, name, start, end, **args):
+        self.events.append({
+            'name': name, 'cat': 'autostar', 'ph': 'X', 'pid': self.pid,
+            'tid': threading.current_thread().ident,
+            'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': args,
+        })
+
+    def clear(self):
+        self.events.clear()
+
+    def export_chrome(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}, f)
+
+
+class TracedLock(object):
+    def __init__(self, lock, tracer):
+        self.lock = lock
+        self.tracer = tracer
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.tracer.span('enqueue', start, time.perf_counter(), acquired=acquired)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class TracedPort(object):
+    def __init__(self, port, tracer):
+        self.port = port
+        self.tracer = tracer
+        self.pending = collections.deque()
+        self.written = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def write(self, data):
+        start = time.perf_counter()
+        result = self.port.write(data)
+        end = time.perf_counter()
+        commands = [c + '#' for c in data.split('#') if c] if data != '\x06' else [data]
+        for command in commands:
+            self.pending.append((split_command(command), start))
+        self.tracer.span('write', start, end, commands=len(commands), bytes=len(data))
+        self.written = end
+        return result
+
+    def reset_input_buffer(self):
+        self.pending.clear()
+        return self.port.reset_input_buffer()
+
+    def readline(self):
+        (opcode, args), started = self.pending.popleft() if self.pending else (('?', ''), None)
+        start = time.perf_counter()
+        if getattr(self.port, 'framed', False):
+            # a framing wrapper knows how long each reply is; reading around it would desync it,
+            # so it reports when the first byte of the reply arrived
+            frame = self.port.readline()
+            end = time.perf_counter()
+            first = frame
+            first_byte = getattr(self.port, 'first_byte', None) or end
+            # commands that answer nothing read as '' without it being a timeout
+            timeout = not frame and framing.SHAPES.get(opcode, (framing.NONE,))[0] != framing.NONE
+        else:
+            first = self.port.read(1)
+            first_byte = time.perf_counter()
+            if isinstance(first, bytes):
+                # read() gives bytes and readline() text on RawPort and the simulator
+                first = first.decode('latin-1')
+            frame = first if not first or first == '#' else first + self.port.readline()
+            end = time.perf_counter()
+            timeout = not first
+        if started is None:
+            started = start
+        self.tracer.span('wait', max(start, self.written), first_byte, opcode=opcode)
+        if first:
+            self.tracer.span('receive', first_byte, end, opcode=opcode, bytes=len(frame))
+        self.tracer.span('command', started, end, opcode=opcode, args=args, timeout=timeout)
+        return frame
+
+
+def enable(scope, tracer=None):
+    if tracer is None:
+        tracer = Tracer()
+    if not isinstance(scope.port, TracedPort):
+        scope.port = TracedPort(scope.port, tracer)
+        scope.lock = TracedLock(scope.lock, tracer)
+    return scope.port.tracer
+
+def disable(scope):
+    if isinstance(scope.port, TracedPort):
+        scope.port = scope.port.port
+        scope.lock = scope.lock.lock
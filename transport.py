@@ -0,0 +1,170 @@
+import errno
+import os
+import select
+import termios
+import time
+
+
+# Raw tty transport
+# Drop-in replacement for the pyserial port used by Autostar (write/readline/
+# reset_input_buffer/close), talking to the tty through termios and waiting with
+# epoll (or poll where epoll is unavailable). Received bytes land in one
+# preallocated bytearray via os.readv, and read_frame() hands out '#'-terminated
+# replies as memoryview slices of that buffer, so hot decoders never copy.
+
+BAUD_RATES = {
+    1200: termios.B1200, 2400: termios.B2400, 4800: termios.B4800, 9600: termios.B9600,
+    19200: termios.B19200, 38400: termios.B38400, 57600: termios.B57600,
+}
+# termios has no 14400 or 28800, which :SB5# and :SB3# would switch the handset to
+
+
+def _speed(baudrate):
+    if baudrate not in BAUD_RATES:
+        raise ValueError('unsupported baud rate {} (one of {})'.format(baudrate, sorted(BAUD_RATES)))
+    return BAUD_RATES[baudrate]
+
+
+class RawPort(object):
+    def __init__(self, device='/dev/ttyAMA0', baudrate=9600, timeout=1, size=4096):
+        self.device = device
+        self.timeout = timeout
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.head = 0
+        self.tail = 0
+        _speed(baudrate)  # before the tty is opened, so a bad rate leaks no fd
+        self.fd = os.open(device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        self.configure(baudrate)
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+            self.poller.register(self.fd, select.EPOLLIN)
+            self.scale = 1.0
+        else:
+            self.poller = select.poll()
+            self.poller.register(self.fd, select.POLLIN)
+            self.scale = 1000.0
+
+    def configure(self, baudrate):
+        # raw 8N1, no flow control, reads return whatever is available
+        speed = _speed(baudrate)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[0] = 0
+        attrs[1] = 0
+        attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL
+        attrs[3] = 0
+        attrs[4] = attrs[5] = speed
+        attrs[6][termios.VMIN] = 0
+        attrs[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self.baudrate = baudrate
+
+    def close(self):
+        if self.fd is not None:
+            self.poller.close()
+            os.close(self.fd)
+            self.fd = None
+
+    def write(self, data):
+        if not isinstance(data, (bytes, bytearray)):
+            data = data.encode('latin-1')
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self.fd, view)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                select.select([], [self.fd], [], self.timeout)
+                continue
+            view = view[n:]
+        return len(data)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+        self.head = self.tail = 0
+
+    def _fill(self, deadline):
+        # Wait for input and append it after self.tail. Returns False on timeout.
+        if self.head == self.tail:
+            self.head = self.tail = 0
+        elif self.tail == len(self.buffer):
+            # compact: move the unread bytes to the front of the buffer
+            pending = self.tail - self.head
+            self.buffer[:pending] = self.view[self.head:self.tail]
+            self.head, self.tail = 0, pending
+            if pending == len(self.buffer):
+                raise IOError('receive buffer full without a frame terminator')
+        remaining = deadline - time.time()
+        if remaining <= 0 or not self.poller.poll(remaining * self.scale):
+            return False
+        try:
+            n = os.readv(self.fd, [self.view[self.tail:]])
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return True
+            raise
+        self.tail += n
+        return True
+
+    def read_frame(self, terminator=b'#'):
+        # Next reply as a memoryview ending with the terminator, or the partial data received
+        # before the timeout. The view is only valid until the next read on this port.
+        deadline = time.time() + self.timeout
+        searched = 0
+        while True:
+            end = self.buffer.find(terminator, self.head + searched, self.tail)
+            if end >= 0:
+                frame = self.view[self.head:end + 1]
+                self.head = end + 1
+                return frame
+            searched = self.tail - self.head
+            if not self._fill(deadline):
+                frame = self.view[self.head:self.tail]
+                self.head = self.tail
+                return frame
+
+    def read(self, size=1):
+        # Up to `size` bytes (fewer on timeout), for callers that want the pyserial read() contract
+        deadline = time.time() + self.timeout
+        while self.tail - self.head < size and self._fill(deadline):
+            pass
+        n = min(size, self.tail - self.head)
+        data = self.view[self.head:self.head + n].tobytes().decode('latin-1')
+        self.head += n
+        return data
+
+    def readline(self):
+        return self.read_frame().tobytes().decode('latin-1')
+    # Same contract as the pyserial readline() calls in control.py, but framed on the
+    # '#' terminator the handset actually uses.
+
+
+def sexagesimal(view):
+    # Decode HH:MM:SS#, HH:MM.T#, sDD*MM'SS# or plain sDD.D# straight from a bytes-like frame.
+    sign = 1.0
+    value = 0.0
+    scale = 1.0
+    field = 0.0
+    fraction = 0.0
+    for byte in view:
+        if 48 <= byte <= 57:
+            if fraction:
+                field += (byte - 48) * fraction
+                fraction /= 10.0
+            else:
+                field = field * 10.0 + (byte - 48)
+        elif byte == 46:
+            fraction = 0.1
+        elif byte == 45 and scale == 1.0 and not field:
+            sign = -1.0
+        elif byte == 35:
+            break
+        elif byte in (43, 32):
+            continue
+        else:
+            value += field * scale
+            scale /= 60.0
+            field = 0.0
+            fraction = 0.0
+    return sign * (value + field * scale)